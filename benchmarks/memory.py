@@ -0,0 +1,86 @@
+""" Record store memory benchmark
+
+    Builds the records of generated zones the way import_records does and
+    reports the memory they hold per record, next to the dicts of the
+    former layout built from the same zone.
+
+    >>>
+    python benchmarks/memory.py
+    python benchmarks/memory.py --sizes 1000000
+"""
+
+import os
+import sys
+import gc
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import dns.rdatatype  # noqa: E402
+import dns.zone  # noqa: E402
+
+from server import make_zone, KEY_NAME, KEY_SECRET  # noqa: E402
+from dnsmanager.core import DNSService, RECORD_TYPES  # noqa: E402
+
+ZONE = "bench.local"
+SIZES = [10000, 100000]
+
+
+def allocated(build):
+    """ What ``build()`` returns and the bytes it still holds once built """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+def dict_records(zone, dns_zone):
+    """ The records of ``dns_zone`` as the dicts import_records used to return """
+    origin = dns_zone.origin
+    for name, node in dns_zone.nodes.items():
+        todict = {}
+        for rdataset in node.rdatasets:
+            for rdata in rdataset:
+                if rdataset.rdtype in RECORD_TYPES:
+                    todict["zone"] = zone
+                    todict["name"] = str(name)
+                    todict["content"] = rdata.to_text(origin=origin, relativize=True)
+                    todict["rtype"] = dns.rdatatype.to_text(rdataset.rdtype)
+                    todict["ttl"] = rdataset.ttl
+                    todict["representation"] = rdataset.to_text(origin=origin, relativize=True)
+        if todict:
+            yield todict
+
+def bench_size(size):
+    # relativized like a transferred zone
+    dns_zone = dns.zone.from_text(make_zone(ZONE, size).to_text(), origin=ZONE, relativize=True)
+    service = DNSService(ZONE, "127.0.0.1", KEY_NAME, KEY_SECRET)
+    try:
+        records, record_bytes = allocated(lambda: list(service.zone_records(dns_zone)))
+        dicts, dict_bytes = allocated(lambda: list(dict_records(ZONE, dns_zone)))
+    finally:
+        service.close()
+    return len(records), record_bytes, dict_bytes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma separated zone sizes")
+    options = parser.parse_args(argv)
+
+    print(f"{'SIZE':>8} {'RECORDS (MB)':>13} {'BYTES/RECORD':>13} {'DICTS (MB)':>11} {'BYTES/DICT':>11}")
+    for size in (int(size) for size in options.sizes.split(",")):
+        count, record_bytes, dict_bytes = bench_size(size)
+        print(f"{size:>8} {record_bytes / 2 ** 20:>13.1f} {record_bytes / count:>13.0f} "
+              f"{dict_bytes / 2 ** 20:>11.1f} {dict_bytes / count:>11.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
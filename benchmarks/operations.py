@@ -0,0 +1,174 @@
+""" DNSService benchmarks against the in-process FakeServer
+
+    Reports throughput and latency percentiles of add_record, update_record,
+    remove_record, import_records and the find search paths for each zone
+    size. Results can be saved and later compared with a baseline, which
+    fails the run when throughput drops by more than the tolerance.
+
+    >>>
+    python benchmarks/operations.py
+    python benchmarks/operations.py --sizes 100,10000,1000000 --latency 0.0005
+    python benchmarks/operations.py --transport tcp
+    python benchmarks/operations.py --save baseline.json
+    python benchmarks/operations.py --baseline baseline.json --tolerance 0.25
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server import FakeServer  # noqa: E402
+from dnsmanager.core import DNSService, TRANSPORTS  # noqa: E402
+from dnsmanager.utils import ZoneTrie  # noqa: E402
+from dnsmanager.scripts.commands.utils import (  # noqa: E402
+    searching_dns, bulk_searching_dns, parse_queries
+)
+
+ZONE = "bench.local"
+SIZES = [100, 1000, 10000]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def measure(operation, size, func, calls):
+    """ Time every call of ``func`` over ``calls`` and summarise them """
+    samples = []
+    start = time.perf_counter()
+    for args in calls:
+        began = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    return {
+        "operation": operation,
+        "size": size,
+        "count": len(samples),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "p50": percentile(samples, 0.50) * 1000,
+        "p95": percentile(samples, 0.95) * 1000,
+        "p99": percentile(samples, 0.99) * 1000,
+    }
+
+def check(result):
+    if not result.ok:
+        raise RuntimeError(f"Unexpected response {result}")
+
+def bench_size(size, ops, latency, transport="auto"):
+    results = []
+    with FakeServer(ZONE, size=size, latency=latency) as server:
+        service = DNSService(
+            ZONE, server.address, *server.key, port=server.port, lifetime=600, transport=transport
+        )
+        config = {
+            "dns.zones": {"available": [ZONE]},
+            f"dns.zones.{ZONE}": {
+                "name": ZONE,
+                "server": server.address,
+                "port": server.port,
+                "transport": transport,
+                "keyring_name": server.key[0],
+                "keyring_value": server.key[1],
+            },
+        }
+        names = [f"bench-{index}" for index in range(ops)]
+        results.append(measure(
+            "add_record", size,
+            lambda name: check(service.add_record(name, "192.0.2.1", "A")),
+            [(name,) for name in names]
+        ))
+        results.append(measure(
+            "update_record", size,
+            lambda name: check(service.update_record(name, "192.0.2.2", "A")),
+            [(name,) for name in names]
+        ))
+        results.append(measure(
+            "remove_record", size,
+            lambda name: check(service.remove_record(name, "A")),
+            [(name,) for name in names]
+        ))
+
+        # whole zone transfers, so fewer rounds as the zone grows
+        rounds = max(1, min(ops, 100000 // max(size, 1)))
+        results.append(measure(
+            "import_records", size,
+            lambda: service.import_records(),
+            [()] * rounds
+        ))
+        for match, domain in (("substring", "host-1"), ("exact", f"host-{size // 2}")):
+            results.append(measure(
+                f"find ({match})", size,
+                lambda domain, match: searching_dns(
+                    config, [ZONE], domain, None, None, None, None, match=match, timeout=600
+                ),
+                [(domain, match)] * (rounds if match == "substring" else ops)
+            ))
+        results.append(measure(
+            "find (cidr)", size,
+            lambda: searching_dns(config, [ZONE], "", "10.0.0.0/24", None, None, None, timeout=600),
+            [()] * rounds
+        ))
+        # every name of the record operations in one pass over the zone
+        queries = parse_queries([f"host-{index % size}" for index in range(ops)], ZoneTrie([ZONE]))
+        results.append(measure(
+            f"find (bulk x{len(queries)})", size,
+            lambda: list(bulk_searching_dns(config, [ZONE], queries, timeout=600)),
+            [()] * rounds
+        ))
+        service.close()
+    return results
+
+def compare(results, baseline, tolerance):
+    """ Throughput regressions beyond ``tolerance`` against the baseline results """
+    previous = {(result["operation"], result["size"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["operation"], result["size"]))
+        if before and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result['operation']} @ {result['size']}: "
+                f"{result['throughput']:.1f} ops/s, was {before['throughput']:.1f}"
+            )
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)),
+                        help="comma separated zone sizes, up to 1000000 records")
+    parser.add_argument("--ops", type=int, default=200, help="calls per record operation")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before answering")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="auto", help="transport of the record operations")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare throughput with saved results")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop against the baseline")
+    options = parser.parse_args(argv)
+
+    results = []
+    print(f"{'OPERATION':<18} {'SIZE':>8} {'COUNT':>6} {'OPS/S':>10} {'P50 (ms)':>9} {'P95 (ms)':>9} {'P99 (ms)':>9}")
+    for size in (int(size) for size in options.sizes.split(",")):
+        for result in bench_size(size, options.ops, options.latency, options.transport):
+            results.append(result)
+            print(f"{result['operation']:<18} {result['size']:>8} {result['count']:>6} "
+                  f"{result['throughput']:>10.1f} {result['p50']:>9.2f} {result['p95']:>9.2f} {result['p99']:>9.2f}")
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if options.baseline:
+        with open(options.baseline, "r") as f:
+            regressions = compare(results, json.load(f), options.tolerance)
+        if regressions:
+            print("Throughput regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+""" In-process authoritative DNS server for benchmarks and offline checks
+
+    A dnspython based stand-in for BIND that serves one zone over UDP and
+    TCP on 127.0.0.1. It answers SOA and other plain queries, AXFR and IXFR
+    (from a journal of the UPDATEs it applied) and TSIG-signed UPDATE
+    messages with RFC 2136 prerequisites. TCP connections are kept open and
+    pipelined messages are answered in order, like BIND does.
+
+    >>>
+    with FakeServer("bench.local", size=10000, latency=0.001) as server:
+        service = DNSService("bench.local", server.address, *server.key, port=server.port)
+        service.import_records()
+"""
+
+import time
+import socket
+import struct
+import threading
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.rrset
+import dns.tsig
+import dns.tsigkeyring
+import dns.zone
+from dns.exception import DNSException
+
+KEY_NAME = "bench-key"
+KEY_SECRET = "REinX3E4AQrCn6uoXm3GHA=="
+
+# rrsets per AXFR / IXFR response message
+RRSETS_PER_MESSAGE = 200
+
+
+def make_zone(origin, size=100):
+    """ A zone with SOA, NS and ``size`` generated records: mostly A, some CNAME and MX.
+        Names are kept absolute, so rdatas can go on the wire and be compared as they are.
+    """
+    lines = [
+        "@ 3600 IN SOA ns1 hostmaster 1 3600 600 86400 300",
+        "@ 3600 IN NS ns1",
+        "ns1 3600 IN A 127.0.0.1",
+    ]
+    for index in range(size):
+        name = f"host-{index}"
+        if index % 20 == 19:
+            lines.append(f"{name} 300 IN MX 10 host-{index - 1}")
+        elif index % 10 == 9:
+            lines.append(f"{name} 300 IN CNAME host-{index - 1}")
+        else:
+            lines.append(f"{name} 300 IN A 10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}")
+    return dns.zone.from_text("\n".join(lines), origin=origin, relativize=False)
+
+
+class FakeServer(object):
+    """ Serve a generated zone of ``size`` records on an ephemeral port.
+        ``latency`` seconds are slept before answering every request.
+    """
+
+    def __init__(self, zone, size=100, latency=0.0, key=(KEY_NAME, KEY_SECRET), address="127.0.0.1"):
+        self.zone = make_zone(zone, size)
+        self.origin = self.zone.origin
+        self.latency = latency
+        self.key = key
+        self.keyring = dns.tsigkeyring.from_text({key[0]: key[1]})
+        self.address = address
+        self.lock = threading.Lock()
+        # (serial before, serial after, deleted rrsets, added rrsets) for every applied UPDATE
+        self.journal = []
+        self.requests = 0
+        self.running = False
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind((address, 0))
+        self.port = self.udp.getsockname()[1]
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((address, self.port))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.running = True
+        self.tcp.listen(64)
+        for target in (self.serve_udp, self.serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        for sock in (self.udp, self.tcp):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    @property
+    def serial(self):
+        return self.zone.get_soa().serial
+
+    def serve_udp(self):
+        while self.running:
+            try:
+                wire, peer = self.udp.recvfrom(65535)
+            except OSError:
+                return
+            responses = self.handle(wire, tcp=False)
+            if responses:
+                self.udp.sendto(responses[0], peer)
+
+    def serve_tcp(self):
+        while self.running:
+            try:
+                sock, _ = self.tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_connection, args=(sock,), daemon=True).start()
+
+    def serve_connection(self, sock):
+        # responses go out as soon as they are written, as BIND sends them
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with sock:
+            while self.running:
+                header = self.read(sock, 2)
+                if header is None:
+                    return
+                wire = self.read(sock, struct.unpack("!H", header)[0])
+                if wire is None:
+                    return
+                for response in self.handle(wire, tcp=True):
+                    sock.sendall(struct.pack("!H", len(response)) + response)
+
+    @staticmethod
+    def read(sock, count):
+        data = b""
+        while len(data) < count:
+            try:
+                chunk = sock.recv(count - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def handle(self, wire, tcp=True):
+        """ Wire format responses to one request """
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            query = dns.message.from_wire(wire, keyring=self.keyring)
+        except (dns.tsig.BadSignature, dns.tsig.BadTime, dns.message.UnknownTSIGKey) as e:
+            return [self.tsig_error(wire, e).to_wire()]
+        except DNSException:
+            return []
+
+        rdtype = query.question[0].rdtype if query.question else None
+        if query.opcode() == dns.opcode.UPDATE:
+            messages = [self.update(query)]
+        elif rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            messages = self.transfer(query) if tcp else [self.error(query, dns.rcode.REFUSED)]
+        else:
+            messages = [self.answer(query)]
+
+        # rendered in full, then truncated below as BIND does past the payload of the query
+        wires = [message.to_wire(max_size=65535) for message in messages]
+        payload = query.payload if query.edns >= 0 else 512
+        if not tcp and len(wires[0]) > payload:
+            truncated = dns.message.make_response(query)
+            truncated.flags |= dns.flags.TC
+            wires = [truncated.to_wire()]
+        return wires
+
+    def tsig_error(self, wire, error):
+        """ NOTAUTH carrying the TSIG error, as BIND answers a request it cannot verify """
+        query = dns.message.from_wire(wire, keyring=False)
+        response = self.error(query, dns.rcode.NOTAUTH)
+        if isinstance(error, dns.message.UnknownTSIGKey):
+            tsig_error = dns.rcode.BADKEY
+        elif isinstance(error, dns.tsig.BadTime):
+            tsig_error = dns.rcode.BADTIME
+        else:
+            tsig_error = dns.rcode.BADSIG
+        response.use_tsig(self.keyring, keyname=query.keyname, tsig_error=tsig_error)
+        response.request_mac = query.mac
+        return response
+
+    def error(self, query, rcode):
+        response = dns.message.make_response(query)
+        response.set_rcode(rcode)
+        return response
+
+    def answer(self, query):
+        question = query.question[0]
+        if not question.name.is_subdomain(self.origin):
+            return self.error(query, dns.rcode.REFUSED)
+
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        with self.lock:
+            node = self.zone.get_node(question.name)
+            if node is None:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                return response
+            rdataset = node.get_rdataset(dns.rdataclass.IN, question.rdtype)
+            if rdataset is None:
+                rdataset = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.CNAME)
+            if rdataset is not None:
+                response.answer.append(self.rrset(question.name, rdataset))
+        return response
+
+    @staticmethod
+    def rrset(name, rdataset):
+        rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype)
+        rrset.update(rdataset)
+        return rrset
+
+    def soa_rrset(self, serial=None):
+        rdataset = self.zone.get_rdataset(self.origin, dns.rdatatype.SOA)
+        if serial is not None:
+            rdataset = dns.rdataset.from_rdata(rdataset.ttl, rdataset[0].replace(serial=serial))
+        return self.rrset(self.origin, rdataset)
+
+    def transfer(self, query):
+        """ Response messages to an AXFR, or to an IXFR answered from the journal when it can be """
+        with self.lock:
+            rrsets = None
+            if query.question[0].rdtype == dns.rdatatype.IXFR and query.authority:
+                rrsets = self.incremental(query.authority[0][0].serial)
+            if rrsets is None:
+                rrsets = [self.soa_rrset()]
+                rrsets.extend(
+                    self.rrset(name, rdataset)
+                    for name, node in self.zone.nodes.items()
+                    for rdataset in node.rdatasets
+                    if rdataset.rdtype != dns.rdatatype.SOA
+                )
+                rrsets.append(self.soa_rrset())
+
+        messages = []
+        for start in range(0, len(rrsets), RRSETS_PER_MESSAGE):
+            response = dns.message.make_response(query)
+            response.flags |= dns.flags.AA
+            if start:
+                response.question = []
+            response.answer = rrsets[start:start + RRSETS_PER_MESSAGE]
+            messages.append(response)
+        return messages
+
+    def incremental(self, since):
+        """ IXFR answer from serial ``since``, or None when the journal does not reach back to it """
+        if since == self.serial:
+            return [self.soa_rrset()]
+        entries = [entry for entry in self.journal if entry[0] >= since]
+        if not entries or entries[0][0] != since:
+            return None
+        rrsets = [self.soa_rrset()]
+        for before, after, deleted, added in entries:
+            rrsets.append(self.soa_rrset(before))
+            rrsets.extend(deleted)
+            rrsets.append(self.soa_rrset(after))
+            rrsets.extend(added)
+        rrsets.append(self.soa_rrset())
+        return rrsets
+
+    def update(self, query):
+        """ Apply an RFC 2136 UPDATE, all or nothing """
+        if not query.had_tsig:
+            return self.error(query, dns.rcode.REFUSED)
+        if not query.zone or query.zone[0].name != self.origin:
+            return self.error(query, dns.rcode.NOTAUTH)
+
+        with self.lock:
+            rcode = self.check_prerequisites(query.prerequisite)
+            if rcode != dns.rcode.NOERROR:
+                return self.error(query, rcode)
+
+            deleted, added = [], []
+            # dnspython keeps the ANY and NONE classes of RFC 2136 in rrset.deleting
+            for rrset in query.update:
+                if rrset.deleting == dns.rdataclass.ANY:
+                    node = self.zone.get_node(rrset.name)
+                    if rrset.rdtype == dns.rdatatype.ANY:
+                        rdtypes = [rdataset.rdtype for rdataset in node.rdatasets] if node else []
+                    else:
+                        rdtypes = [rrset.rdtype]
+                    for rdtype in rdtypes:
+                        if rrset.name == self.origin and rdtype in (dns.rdatatype.SOA, dns.rdatatype.NS):
+                            continue
+                        deleted.extend(self.delete(rrset.name, rdtype))
+                elif rrset.deleting == dns.rdataclass.NONE:
+                    deleted.extend(self.delete(rrset.name, rrset.rdtype, rrset))
+                else:
+                    rdataset = self.zone.find_rdataset(rrset.name, rrset.rdtype, create=True)
+                    for rdata in rrset:
+                        rdataset.add(rdata, rrset.ttl)
+                    added.append(rrset)
+
+            if deleted or added:
+                before = self.serial
+                after = (before + 1) & 0xFFFFFFFF
+                self.zone.replace_rdataset(self.origin, self.soa_rrset(after).to_rdataset())
+                self.journal.append((before, after, deleted, added))
+
+        return dns.message.make_response(query)
+
+    def check_prerequisites(self, prerequisites):
+        for rrset in prerequisites:
+            node = self.zone.get_node(rrset.name)
+            rdataset = node.get_rdataset(dns.rdataclass.IN, rrset.rdtype) if node else None
+            if rrset.deleting == dns.rdataclass.NONE:
+                if rrset.rdtype == dns.rdatatype.ANY and node:
+                    return dns.rcode.YXDOMAIN
+                if rrset.rdtype != dns.rdatatype.ANY and rdataset:
+                    return dns.rcode.YXRRSET
+            elif rrset.deleting == dns.rdataclass.ANY:
+                if rrset.rdtype == dns.rdatatype.ANY and not node:
+                    return dns.rcode.NXDOMAIN
+                if rrset.rdtype != dns.rdatatype.ANY and not rdataset:
+                    return dns.rcode.NXRRSET
+        return dns.rcode.NOERROR
+
+    def delete(self, name, rdtype, rrset=None):
+        """ Delete an RRset, or only the records of ``rrset`` from it; returns what was deleted """
+        rdataset = self.zone.get_rdataset(name, rdtype)
+        if rdataset is None:
+            return []
+        gone = self.rrset(name, rdataset)
+        if rrset is not None:
+            gone = gone.intersection(rrset)
+            remaining = rdataset.difference(rrset)
+            if remaining:
+                self.zone.replace_rdataset(name, remaining)
+                return [gone] if gone else []
+        self.zone.delete_rdataset(name, rdtype)
+        return [gone] if gone else []
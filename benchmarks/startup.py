@@ -0,0 +1,107 @@
+""" CLI startup benchmark
+
+    Runs the dnsmanager entry point under ``python -X importtime`` and fails
+    when the median import time of a scenario goes over its budget.
+
+    >>>
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --budget find=250
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """
+[dns.zones]
+available =
+    bench.local
+
+[dns.zones.bench.local]
+name = bench.local
+server = 127.0.0.1
+keyring_name = rndc-key
+keyring_value = REinX3E4AQrCn6uoXm3GHA==
+"""
+
+# scenario -> (arguments, import time budget in milliseconds)
+SCENARIOS = {
+    "version": (["--version"], 80),
+    "help": (["--help"], 100),
+    "find": (["find", "cute.bench.local", "--timeout", "0.1", "--no-cache"], 300),
+}
+
+
+def import_time(stderr):
+    """ Total of the cumulative times, in milliseconds, of the top-level imports """
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total / 1000
+
+def run(args, config):
+    command = [
+        sys.executable, "-X", "importtime",
+        "-c", "import sys; from dnsmanager.scripts.cli import cli; cli(sys.argv[1:])",
+        "--config-file", config, *args
+    ]
+    start = time.perf_counter()
+    process = subprocess.run(
+        command, cwd=ROOT, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True
+    )
+    return import_time(process.stderr), (time.perf_counter() - start) * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0].strip())
+    parser.add_argument("--runs", type=int, default=5, help="runs per scenario, the median is reported")
+    parser.add_argument("--budget", action="append", default=[], metavar="SCENARIO=MS",
+                        help="override the import time budget of a scenario")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"scenarios to run, out of {', '.join(SCENARIOS)} (default: all)")
+    options = parser.parse_args(argv)
+    unknown = [name for name in options.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {', '.join(unknown)}")
+    options.scenarios = options.scenarios or list(SCENARIOS)
+
+    budgets = {name: budget for name, (_, budget) in SCENARIOS.items()}
+    for override in options.budget:
+        name, _, value = override.partition("=")
+        budgets[name] = float(value)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+        f.write(CONFIG)
+    failed = []
+    try:
+        print(f"{'SCENARIO':<10} {'IMPORT (ms)':>12} {'WALL (ms)':>10} {'BUDGET (ms)':>12}")
+        for name in options.scenarios:
+            args, _ = SCENARIOS[name]
+            samples = [run(args, f.name) for _ in range(options.runs)]
+            imports = statistics.median(sample[0] for sample in samples)
+            wall = statistics.median(sample[1] for sample in samples)
+            over = imports > budgets[name]
+            if over:
+                failed.append(name)
+            print(f"{name:<10} {imports:>12.1f} {wall:>10.1f} {budgets[name]:>12.1f}{'  OVER' if over else ''}")
+    finally:
+        os.remove(f.name)
+
+    if failed:
+        print(f"Startup budget exceeded for: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,14 @@ __description__ = "DNS Manager Suites (BIND9)"
 
 
 __all__ = [
+    "cache",
+    "connection",
     "core",
-    "errors"
+    "errors",
+    "index",
+    "manifest",
+    "metrics",
+    "plan",
+    "records",
+    "registry"
 ]
\ No newline at end of file
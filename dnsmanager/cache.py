@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import pickle
+import tempfile
+import threading
+
+# seconds a measured nameserver round trip is trusted before it is measured again
+RTT_MAX_AGE = 3600
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dnsmanager")
+
+
+class ZoneCache(object):
+    """ Persistent zone snapshots, keyed by zone and nameserver.
+
+        Each snapshot is the pickled ``dns.zone.Zone`` (several times faster
+        to load than re-parsing zone file text) next to a small JSON metadata
+        file holding the SOA serial, so freshness can be checked without
+        loading the zone itself. Measured nameserver round trips are kept
+        in ``nameservers.json`` to order the up to date servers of a transfer.
+
+        Files are written through unique tmp files and replaced, and the
+        read-modify-write of ``nameservers.json`` holds a lock, so the
+        zones of one find can be fetched from concurrent threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = os.path.expanduser(path or default_cache_dir())
+        self.lock = threading.RLock()
+
+    def filename(self, zone, nameserver, ext="pickle"):
+        key = f"{zone}@{nameserver}".replace(os.sep, "_")
+        return os.path.join(self.path, "zones", f"{key}.{ext}")
+
+    def replace(self, filename, dump, mode="wb"):
+        """ Write ``filename`` with ``dump(f)`` into a tmp file of its own, then move it in place """
+        directory = os.path.dirname(filename)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode) as f:
+                dump(f)
+            os.replace(tmp, filename)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def metadata(self, zone, nameserver):
+        try:
+            with open(self.filename(zone, nameserver, "json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def serial(self, zone, nameserver):
+        meta = self.metadata(zone, nameserver)
+        if not meta:
+            return None
+        return meta.get("serial")
+
+    def load(self, zone, nameserver):
+        try:
+            with open(self.filename(zone, nameserver), "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    def save(self, zone, nameserver, dns_zone):
+        self.replace(
+            self.filename(zone, nameserver),
+            lambda f: pickle.dump(dns_zone, f, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        meta = {
+            "zone": zone,
+            "nameserver": nameserver,
+            "serial": dns_zone.get_soa().serial,
+            "updated": time.time(),
+        }
+        self.replace(self.filename(zone, nameserver, "json"), lambda f: json.dump(meta, f), mode="w")
+
+    def load_index(self, zone, nameserver, serial, ext="ipindex"):
+        """ The index built from the snapshot with ``serial``, if there is one """
+        try:
+            with open(self.filename(zone, nameserver, ext), "rb") as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        return index if index.serial == serial else None
+
+    def save_index(self, zone, nameserver, index, ext="ipindex"):
+        self.replace(
+            self.filename(zone, nameserver, ext),
+            lambda f: pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def invalidate(self, zone, nameserver):
+        for ext in ("json", "pickle", "ipindex", "nameindex"):
+            try:
+                os.remove(self.filename(zone, nameserver, ext))
+            except FileNotFoundError:
+                pass
+
+    def read_rtts(self):
+        try:
+            with open(os.path.join(self.path, "nameservers.json"), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_rtts(self, data):
+        self.replace(os.path.join(self.path, "nameservers.json"), lambda f: json.dump(data, f), mode="w")
+
+    def rtts(self, nameservers, max_age=RTT_MAX_AGE):
+        """ Remembered round trips, in seconds, of the nameservers measured in the last ``max_age`` seconds """
+        data = self.read_rtts()
+        now = time.time()
+        return {
+            nameserver: data[nameserver]["rtt"]
+            for nameserver in nameservers
+            if nameserver in data and now - data[nameserver]["updated"] < max_age
+        }
+
+    def save_rtts(self, rtts):
+        """ Remember round trips. They only order nameservers, so failing to write them is ignored """
+        try:
+            with self.lock:
+                data = self.read_rtts()
+                now = time.time()
+                for nameserver, rtt in rtts.items():
+                    data[nameserver] = {"rtt": rtt, "updated": now}
+                self.write_rtts(data)
+        except OSError:
+            pass
+
+    def forget_rtt(self, nameserver):
+        try:
+            with self.lock:
+                data = self.read_rtts()
+                if data.pop(nameserver, None) is not None:
+                    self.write_rtts(data)
+        except OSError:
+            pass
+
+
+class MemoryZoneCache(ZoneCache):
+    """ A ZoneCache that also keeps the snapshots, metadata and indexes it
+        loads or saves in memory, for a long-running process such as
+        `dnsmanager serve`. Everything is still written through to disk.
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.entries = {}
+
+    def metadata(self, zone, nameserver):
+        meta = self.entries.get((zone, nameserver, "json"))
+        if meta is None:
+            meta = super().metadata(zone, nameserver)
+            if meta is not None:
+                self.entries[(zone, nameserver, "json")] = meta
+        return meta
+
+    def load(self, zone, nameserver):
+        dns_zone = self.entries.get((zone, nameserver, "pickle"))
+        if dns_zone is None:
+            dns_zone = super().load(zone, nameserver)
+            if dns_zone is not None:
+                self.entries[(zone, nameserver, "pickle")] = dns_zone
+        return dns_zone
+
+    def save(self, zone, nameserver, dns_zone):
+        with self.lock:
+            super().save(zone, nameserver, dns_zone)
+            self.entries[(zone, nameserver, "pickle")] = dns_zone
+            self.entries.pop((zone, nameserver, "json"), None)
+
+    def load_index(self, zone, nameserver, serial, ext="ipindex"):
+        index = self.entries.get((zone, nameserver, ext))
+        if index is None or index.serial != serial:
+            index = super().load_index(zone, nameserver, serial, ext=ext)
+            if index is not None:
+                self.entries[(zone, nameserver, ext)] = index
+        return index
+
+    def save_index(self, zone, nameserver, index, ext="ipindex"):
+        with self.lock:
+            super().save_index(zone, nameserver, index, ext=ext)
+            self.entries[(zone, nameserver, ext)] = index
+
+    def invalidate(self, zone, nameserver):
+        with self.lock:
+            super().invalidate(zone, nameserver)
+            for key in [key for key in self.entries if key[:2] == (zone, nameserver)]:
+                del self.entries[key]
@@ -0,0 +1,218 @@
+import time
+import select
+import socket
+import struct
+import threading
+from collections import namedtuple
+
+import dns.entropy
+import dns.exception
+import dns.inet
+import dns.message
+import dns.query
+
+# a response with the seconds it took and the wire sizes of the message and its response
+Exchange = namedtuple("Exchange", ["response", "elapsed", "request_size", "response_size"])
+
+# EDNS payload advertised over UDP, the size of the 2020 DNS flag day that avoids fragmentation
+DEFAULT_PAYLOAD = 1232
+
+# seconds before an unanswered datagram is sent again, doubled on every retry
+UDP_RETRY_INTERVAL = 1.0
+
+
+class Connection(object):
+    """ A TCP connection to a nameserver, kept open and reused for successive messages.
+
+        Messages handed to ``pipeline`` are all written before any response
+        is read, and responses are matched back by message id, so a batch
+        costs one round trip. A connection the server closed while idle is
+        reopened transparently and unanswered messages are sent again.
+    """
+
+    def __init__(self, nameserver, port=53, timeout=10, depth=16):
+        self.nameserver = nameserver
+        self.port = port
+        self.timeout = timeout
+        self.depth = depth
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        if self.sock is not None and not self.alive():
+            self.close()
+        if self.sock is None:
+            self.sock = socket.create_connection((self.nameserver, self.port), timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.sock
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    def alive(self):
+        """ False once the server has closed its side of the connection """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            if not readable:
+                return True
+            return self.sock.recv(1, socket.MSG_PEEK) != b""
+        except (OSError, ValueError):
+            return False
+
+    def query(self, message, timeout=None):
+        return self.pipeline([message], timeout=timeout)[0]
+
+    def pipeline(self, messages, timeout=None):
+        """ Send messages and return their responses in the same order """
+        return [exchange.response for exchange in self.exchange(messages, timeout=timeout)]
+
+    def exchange(self, messages, timeout=None):
+        """ Like pipeline, but return an Exchange for every message """
+        timeout = self.timeout if timeout is None else timeout
+        responses = {}
+        with self.lock:
+            for start in range(0, len(messages), self.depth):
+                window = messages[start:start + self.depth]
+                pending = self._assign_ids(window)
+                retried = False
+                while pending:
+                    remaining = len(pending)
+                    try:
+                        self._exchange(pending, responses, timeout)
+                    except (EOFError, ConnectionError):
+                        # idle close, or a server that answers one message per
+                        # connection: reconnect and send what is still unanswered
+                        self.close()
+                        if retried and len(pending) == remaining:
+                            raise
+                        retried = len(pending) == remaining
+                    except BaseException:
+                        # unread or half read frames would be taken for the next responses
+                        self.close()
+                        raise
+        return [responses[id(message)] for message in messages]
+
+    def _assign_ids(self, messages):
+        pending = {}
+        for message in messages:
+            while message.id in pending:
+                message.id = dns.entropy.random_16()
+            pending[message.id] = message
+        return pending
+
+    def _exchange(self, pending, responses, timeout):
+        sock = self.open()
+        sock.settimeout(timeout)
+        start = time.time()
+        expiration = start + timeout if timeout else None
+        wires = {
+            message_id: message.to_wire(prepend_length=True)
+            for message_id, message in pending.items()
+        }
+        sock.sendall(b"".join(wires.values()))
+        while pending:
+            (length,) = struct.unpack("!H", self._read(sock, 2, expiration))
+            wire = self._read(sock, length, expiration)
+            (message_id,) = struct.unpack("!H", wire[:2])
+            message = pending.get(message_id)
+            if message is None:
+                continue
+            response = dns.message.from_wire(
+                wire, keyring=message.keyring, request_mac=message.mac
+            )
+            if not message.is_response(response):
+                raise dns.query.BadResponse
+            del pending[message_id]
+            responses[id(message)] = Exchange(
+                response, time.time() - start, len(wires[message_id]) - 2, length
+            )
+
+    def _read(self, sock, count, expiration):
+        data = b""
+        while len(data) < count:
+            if expiration is not None:
+                sock.settimeout(max(expiration - time.time(), 0.001))
+            try:
+                chunk = sock.recv(count - len(data))
+            except socket.timeout:
+                raise dns.exception.Timeout
+            if not chunk:
+                raise EOFError("EOF")
+            data += chunk
+        return data
+
+
+def udp_exchange(messages, nameserver, port=53, timeout=10, payload=DEFAULT_PAYLOAD, depth=16):
+    """ Send messages over UDP and return an Exchange for each of them, in order.
+
+        Messages go out with an EDNS payload of ``payload`` bytes, a window
+        of ``depth`` at a time, and responses are matched back by message
+        id. Unanswered datagrams are sent again after UDP_RETRY_INTERVAL,
+        then twice as long, until ``timeout``. A message larger than
+        ``payload``, or whose response comes back truncated, gets None
+        instead of an Exchange so it can be sent over TCP.
+    """
+    exchanges = [None] * len(messages)
+    with socket.socket(dns.inet.af_for_address(nameserver), socket.SOCK_DGRAM) as sock:
+        # a connected socket only receives datagrams from the nameserver
+        sock.connect((nameserver, port))
+        for start in range(0, len(messages), depth):
+            pending = {}
+            for position in range(start, min(start + depth, len(messages))):
+                message = messages[position]
+                while message.id in pending:
+                    message.id = dns.entropy.random_16()
+                if message.edns < 0:
+                    message.use_edns(0, payload=payload, request_payload=65535)
+                wire = message.to_wire()
+                if len(wire) <= payload:
+                    pending[message.id] = (position, wire)
+            _udp_window(sock, messages, pending, exchanges, timeout)
+    return exchanges
+
+def _udp_window(sock, messages, pending, exchanges, timeout):
+    start = time.time()
+    expiration = start + timeout if timeout else None
+    interval = UDP_RETRY_INTERVAL
+    while pending:
+        if expiration is not None and time.time() >= expiration:
+            raise dns.exception.Timeout
+        for _, wire in pending.values():
+            sock.send(wire)
+        retry = time.time() + interval
+        if expiration is not None:
+            retry = min(retry, expiration)
+        interval *= 2
+        while pending:
+            readable, _, _ = select.select([sock], [], [], max(retry - time.time(), 0))
+            if not readable:
+                break
+            wire = sock.recv(65535)
+            if len(wire) < 12:
+                continue
+            (message_id,) = struct.unpack("!H", wire[:2])
+            if message_id not in pending:
+                continue
+            position, request = pending[message_id]
+            message = messages[position]
+            try:
+                response = dns.message.from_wire(
+                    wire, keyring=message.keyring, request_mac=message.mac, raise_on_truncation=True
+                )
+            except dns.message.Truncated:
+                del pending[message_id]
+                continue
+            if not message.is_response(response):
+                continue
+            del pending[message_id]
+            exchanges[position] = Exchange(response, time.time() - start, len(request), len(wire))
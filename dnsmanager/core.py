@@ -1,113 +1,921 @@
+import time
+import asyncio
+import weakref
+from collections import OrderedDict
+from concurrent.futures import as_completed
+
+import dns.asyncquery
+import dns.asyncresolver
 import dns.update
-import dns.tsigkeyring
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rdata
 import dns.resolver
 import dns.rdatatype
 import dns.query
+import dns.rcode
 import dns.zone
+import dns.xfr
 import dns.rdataclass
 import dns.tsig
-from dns.exception import DNSException
+from dns.exception import DNSException, FormError
+
+from dnsmanager.connection import udp_exchange, DEFAULT_PAYLOAD
+from dnsmanager.index import IPIndex, NameIndex, INDEX_FORMAT
+from dnsmanager.metrics import metrics
+from dnsmanager.records import Record
+from dnsmanager.utils import DaemonPool
+from dnsmanager.registry import registry
+
+# record types DNSService can add, update and remove
+SUPPORTED_TYPES = (
+    dns.rdatatype.A,
+    dns.rdatatype.CNAME,
+    dns.rdatatype.PTR,
+    dns.rdatatype.MX,
+    dns.rdatatype.TXT,
+    dns.rdatatype.SRV,
+)
+
+# record types reported by import_records and lookup_records
+RECORD_TYPES = (
+    dns.rdatatype.A,
+    dns.rdatatype.CNAME,
+    dns.rdatatype.MX,
+)
+
+# room left for the header, zone section and TSIG record of an UPDATE sent over TCP
+MAX_UPDATE_SIZE = 60000
+
+# room left in a datagram for the header, zone section, OPT and TSIG records of an UPDATE
+UDP_UPDATE_ROOM = 512
+
+# how messages reach the nameserver: "auto" sends those that fit in the EDNS
+# payload over UDP, and the others and those answered truncated over TCP
+TRANSPORTS = ("udp", "tcp", "auto")
+
+# errors after which an IXFR is retried as a full AXFR
+IXFR_FALLBACK_ERRORS = (dns.xfr.TransferError, FormError, EOFError)
+
+# in-flight requests AsyncDNSService allows per nameserver
+MAX_IN_FLIGHT = 32
+
+# RFC 2136 prerequisites for add_record
+NAME_NOT_IN_USE = "name-not-in-use"
+RRSET_NOT_EXISTS = "rrset-not-exists"
+
+
+def group_records(records, action="replace"):
+    """ Turn records (dicts with name, content, rtype and ttl) into one change per RRset """
+    changes = OrderedDict()
+    for record in records:
+        key = (record["name"], record["rtype"])
+        change = changes.get(key)
+        if change is None:
+            change = changes[key] = {
+                "action": action,
+                "name": record["name"],
+                "rtype": record["rtype"],
+                "ttl": record["ttl"],
+                "content": [],
+            }
+        change["ttl"] = min(change["ttl"], record["ttl"])
+        change["content"].append(record["content"])
+    return list(changes.values())
+
+class Result(object):
+    """ Outcome of one message sent to the nameserver.
+
+        ``rcode`` is the dns.rcode.Rcode of the response, or None when the
+        exchange failed with ``error``. The response is only rendered as
+        text when ``text`` is asked for.
+    """
+
+    __slots__ = ("rcode", "error", "elapsed", "request_size", "response_size", "nameserver", "response")
+
+    def __init__(self, rcode=None, error=None, elapsed=None, request_size=None, response_size=None,
+                 nameserver=None, response=None):
+        self.rcode = rcode
+        self.error = error
+        self.elapsed = elapsed
+        self.request_size = request_size
+        self.response_size = response_size
+        self.nameserver = nameserver
+        self.response = response
+
+    def __repr__(self):
+        return f"Result({self}, elapsed={self.elapsed !r}, nameserver={self.nameserver !r})"
+
+    def __str__(self):
+        return self.error if self.err else self.rcode_text
+
+    @property
+    def err(self):
+        return self.error is not None
+
+    @property
+    def ok(self):
+        return not self.err and self.rcode == dns.rcode.NOERROR
+
+    @property
+    def rcode_text(self):
+        return None if self.rcode is None else dns.rcode.to_text(self.rcode)
+
+    @property
+    def text(self):
+        return self.error if self.response is None else str(self.response)
+
+    def to_dict(self):
+        return {
+            "rcode": self.rcode_text,
+            "error": self.error,
+            "elapsed": self.elapsed,
+            "request_size": self.request_size,
+            "response_size": self.response_size,
+            "nameserver": self.nameserver,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Result from to_dict output with its ``text``, as `dnsmanager serve` answers.
+            The response is then kept as that text only.
+        """
+        return cls(
+            rcode=None if data.get("rcode") is None else dns.rcode.from_text(data["rcode"]),
+            error=data.get("error"),
+            elapsed=data.get("elapsed"),
+            request_size=data.get("request_size"),
+            response_size=data.get("response_size"),
+            nameserver=data.get("nameserver"),
+            response=data.get("text"),
+        )
+
+def order_nameservers(nameservers, probes, rtts=None):
+    """ Highest SOA serial first, then the shortest round trip.
+        ``probes`` maps nameserver -> (serial, rtt); unanswered ones go last.
+        Round trips in ``rtts``, remembered from earlier runs, take the
+        place of the single probe measurement.
+    """
+    rtts = rtts or {}
+
+    def key(nameserver):
+        if nameserver not in probes:
+            return (1, 0, 0)
+        serial, rtt = probes[nameserver]
+        return (0, -serial, rtts.get(nameserver, rtt))
+    return sorted(nameservers, key=key)
+
+def remember_rtts(cache, probes, rtts):
+    """ Save the round trips of the probes for the nameservers the cache had none for """
+    measured = {nameserver: rtt for nameserver, (_, rtt) in probes.items() if nameserver not in rtts}
+    if cache is not None and measured:
+        cache.save_rtts(measured)
 
 
 class DNSService(object):
+    """ Record operations and zone transfers of one zone.
+
+        ``nameserver`` may be an address or a hostname. The address it
+        resolves to, the parsed keyring and the connection are taken from
+        the process-wide registry, so services of zones on the same server
+        and key share them.
+
+        ``transport`` is one of TRANSPORTS. Over a WAN a single record
+        update costs one round trip over UDP against two with a TCP
+        handshake, while batches of apply_changes are pipelined over TCP
+        in "auto" mode, in order. UPDATEs with prerequisites always go over
+        TCP, as a retransmitted one would fail on the first one's change.
+    """
     
-    def __init__(self, zone, nameserver, keyring_name, keyring_value, timeout=10):
+    def __init__(self, zone, nameserver, keyring_name, keyring_value, timeout=10, lifetime=None, port=53,
+                 transport="auto", payload=DEFAULT_PAYLOAD):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport ({transport}), expected one of {', '.join(TRANSPORTS)}")
         self.zone = zone
         self.nameserver = nameserver
-        self.keyring = dns.tsigkeyring.from_text(
-            {keyring_name: keyring_value}
-        )
+        self.port = port
+        self.transport = transport
+        self.payload = payload
+        self.keyring = registry.keyring(keyring_name, keyring_value)
         self.timeout = timeout
+        self.lifetime = lifetime
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Nothing to release: the connection is shared with every service on
+            the same address and port, and closed by registry.invalidate()
+        """
+
+    @property
+    def address(self):
+        """ Address of the configured nameserver, while its DNS answer is fresh """
+        return registry.address(self.nameserver)
+
+    @property
+    def connection(self):
+        return registry.connection(self.address, port=self.port, timeout=self.timeout)
     
     @property
     def process_msg(self):
-        try:
-            result = self.process_result
-        except AttributeError:
-            result = None
-        finally:
-            return result
+        """ Text of the last response, rendered on demand """
+        result = getattr(self, "last_result", None)
+        return result.text if result is not None else None
+
+    def add_record(self, name, content, rtype, ttl=300, prerequisite=None):
+        return self.handler(self.add_message(name, content, rtype, ttl, prerequisite))
+    
+    def update_record(self, name, content, rtype, ttl=300):
+        return self.handler(self.update_message(name, content, rtype, ttl))
+        
+    def remove_record(self, name, rtype=None):
+        return self.handler(self.remove_message(name, rtype))
 
-    def add_record(self, name, content, rtype, ttl=300):
+    def add_message(self, name, content, rtype, ttl=300, prerequisite=None):
         rtype = self.validate_rtype(rtype)
         data = dns.update.Update(self.zone, keyring=self.keyring)
+        if prerequisite == NAME_NOT_IN_USE:
+            data.absent(name)
+        elif prerequisite == RRSET_NOT_EXISTS:
+            data.absent(name, rtype)
+        elif prerequisite:
+            raise ValueError(f"Unknown prerequisite {prerequisite}")
         data.add(name, ttl, rtype, content)
-        return self.handler(data)
-    
-    def update_record(self, name, content, rtype, ttl=300):
+        return data
+
+    def update_message(self, name, content, rtype, ttl=300):
         rtype = self.validate_rtype(rtype)
         data = dns.update.Update(self.zone, keyring=self.keyring)
         data.replace(name, ttl, rtype, content)
-        return self.handler(data)
-        
-    def remove_record(self, name, rtype=None):
+        return data
+
+    def remove_message(self, name, rtype=None):
         if rtype:
             rtype = self.validate_rtype(rtype)
         data = dns.update.Update(self.zone, keyring=self.keyring)
         data.delete(name, rtype)
-        return self.handler(data)
+        return data
+
+    def apply_records(self, records, replace=True):
+        """ Send many records in as few UPDATE messages as fit.
+            Returns a Result for every message sent.
+        """
+        return self.apply_changes(group_records(records, "replace" if replace else "add"))
+
+    def apply_changes(self, changes):
+        """ Send RRset changes (see group_records and dnsmanager.plan), pipelined over the transport """
+        return self.handler_many(list(self.batch_updates(changes, max_size=self.max_update_size)))
+
+    @property
+    def max_update_size(self):
+        """ Bytes of changes an UPDATE may carry: a datagram's worth when only UDP is used """
+        if self.transport == "udp":
+            return self.payload - UDP_UPDATE_ROOM
+        return MAX_UPDATE_SIZE
+
+    def batch_updates(self, changes, max_size=MAX_UPDATE_SIZE):
+        """ Pack RRset changes into UPDATE messages of at most ``max_size`` bytes.
+            A change never spans two messages, so a replace deletes the old
+            RRset and adds the new one atomically.
+        """
+        origin = dns.name.from_text(self.zone)
+        data, size = None, 0
+        for change in changes:
+            action = change["action"]
+            rtype = self.validate_rtype(change["rtype"])
+            name = dns.name.from_text(change["name"], origin=origin)
+            rdatas = [
+                dns.rdata.from_text(dns.rdataclass.IN, rtype, content, origin=origin)
+                for content in change.get("content") or []
+            ]
 
-    def import_records(self):
-        answer = dns.resolver.query(self.zone, "NS")
+            # uncompressed estimate: owner name + type, class, ttl, rdlength + rdata
+            name_size = len(name.to_wire()) + 10
+            change_size = sum(name_size + len(rdata.to_wire(origin=origin)) for rdata in rdatas)
+            if action in ("replace", "delete"):
+                change_size += name_size
+
+            if data is None or size + change_size > max_size:
+                if data is not None:
+                    yield data
+                data = dns.update.Update(self.zone, keyring=self.keyring)
+                size = len(origin.to_wire()) + 16
+            if action in ("replace", "delete"):
+                data.delete(name, rtype)
+            if action in ("replace", "add"):
+                data.add(name, change["ttl"], *rdatas)
+            size += change_size
+
+        if data is not None:
+            yield data
+
+    def get_serial(self):
+        serial, _ = self.probe(self.address)
+        return serial
+
+    def probe(self, nameserver):
+        """ Ask ``nameserver`` for the zone's SOA, returns its serial and the round trip in seconds """
+        query = dns.message.make_query(self.zone, dns.rdatatype.SOA)
+        start = time.monotonic()
+        response = dns.query.udp(query, nameserver, port=self.port, timeout=self.timeout)
+        return self.soa_serial(response), time.monotonic() - start
+
+    def soa_serial(self, response):
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                return rrset[0].serial
+        raise DNSException(f"No SOA record found for zone {self.zone} on {self.nameserver}")
+
+    def resolver(self, cls=dns.resolver.Resolver, address=None):
+        """ A resolver asking the configured nameserver, which is authoritative for the zone """
+        resolver = cls(configure=False)
+        resolver.nameservers = [address or self.address]
+        resolver.port = self.port
+        return resolver
+
+    @metrics.timed("resolve_ns")
+    def nameservers(self):
+        """ Addresses of the zone's NS set, as the configured nameserver sees it,
+            or the configured nameserver itself when they cannot be resolved
+        """
+        addresses = []
+        try:
+            resolver = self.resolver()
+            answer = resolver.resolve(self.zone, "NS", lifetime=self.lifetime)
+        except (DNSException, ValueError):
+            return [self.address]
         for rdata in answer:
+            # out-of-zone nameservers are left to the system resolver
+            for resolve in (resolver.resolve, dns.resolver.resolve):
+                try:
+                    addresses.extend(
+                        str(address)
+                        for address in resolve(rdata.target, "A", lifetime=self.lifetime)
+                    )
+                    break
+                except DNSException:
+                    continue
+        return list(OrderedDict.fromkeys(addresses)) or [self.address]
+
+    @metrics.timed("probe")
+    def rank_nameservers(self, nameservers, cache=None):
+        """ Order nameservers to transfer from. Every nameserver is probed
+            concurrently for its serial, as a lagging server must never be
+            picked; those with the highest serial are ordered by the round
+            trip remembered in the cache, or the one just measured.
+        """
+        rtts = cache.rtts(nameservers) if cache is not None else {}
+        probes = {}
+        with DaemonPool(max_workers=len(nameservers)) as executor:
+            futures = {executor.submit(self.probe, nameserver): nameserver for nameserver in nameservers}
+            for future in as_completed(futures):
+                try:
+                    probes[futures[future]] = future.result()
+                except (DNSException, OSError):
+                    continue
+        remember_rtts(cache, probes, rtts)
+        return order_nameservers(nameservers, probes, rtts)
+
+    def transfer_zone(self, dns_zone=None, cache=None):
+        """ Transfer the zone once, from the best ranked nameserver that answers """
+        errors = []
+        for nameserver in self.rank_nameservers(self.nameservers(), cache=cache):
             try:
-                ns = str(rdata)
-                dns_zone = dns.zone.from_xfr(dns.query.xfr(ns, self.zone))
-            except DNSException as e:
-                raise e
-        
-        records = list()
+                return self.xfr(nameserver, dns_zone)
+            except (DNSException, OSError, EOFError) as e:
+                errors.append(f"{nameserver}: {str(e) or e.__class__.__name__}")
+                if cache is not None:
+                    cache.forget_rtt(nameserver)
+        raise DNSException(f"Zone transfer failed for {self.zone} ({'; '.join(errors)})")
+
+    @metrics.timed("transfer")
+    def xfr(self, nameserver, dns_zone=None):
+        """ Bring ``dns_zone`` up to date with IXFR from its serial,
+            or do a full AXFR when there is no local copy or the server refuses IXFR
+        """
+        if dns_zone is not None:
+            try:
+                query, _ = dns.xfr.make_query(dns_zone, serial=dns_zone.get_soa().serial)
+                dns.query.inbound_xfr(
+                    nameserver, dns_zone, query,
+                    port=self.port,
+                    timeout=self.timeout,
+                    lifetime=self.lifetime
+                )
+                return dns_zone
+            except IXFR_FALLBACK_ERRORS:
+                pass
+        return dns.zone.from_xfr(
+            dns.query.xfr(nameserver, self.zone, port=self.port, lifetime=self.lifetime)
+        )
+
+    def fetch_zone(self, cache=None, refresh=False, incremental=True):
+        """ Return the zone, reusing the cached snapshot while its SOA serial is current
+            and syncing it with IXFR once the serial moves on
+        """
+        snapshot = None
+        if cache is not None and not refresh:
+            serial = cache.serial(self.zone, self.nameserver)
+            if serial is not None:
+                with metrics.phase("cache_load"):
+                    snapshot = cache.load(self.zone, self.nameserver)
+                if snapshot is not None and serial == self.get_serial():
+                    return snapshot
+
+        dns_zone = self.transfer_zone(snapshot if incremental else None, cache=cache)
+        metrics.add("transfer", records=len(dns_zone.nodes))
+        if cache is not None:
+            with metrics.phase("cache_save"):
+                cache.save(self.zone, self.nameserver, dns_zone)
+        return dns_zone
+
+    def ip_index(self, cache=None, refresh=False, dns_zone=None):
+        """ IPIndex of the zone """
+        return self.zone_index("ipindex", self.build_ip_index, cache=cache, refresh=refresh, dns_zone=dns_zone)
+
+    def name_index(self, cache=None, refresh=False, dns_zone=None):
+        """ NameIndex of the zone """
+        return self.zone_index("nameindex", self.build_name_index, cache=cache, refresh=refresh, dns_zone=dns_zone)
+
+    def build_ip_index(self, dns_zone):
+        return IPIndex.from_zone(self.zone, dns_zone)
+
+    def build_name_index(self, dns_zone):
+        return NameIndex(self.zone, dns_zone.get_soa().serial, self.zone_records(dns_zone))
+
+    def zone_index(self, ext, build, cache=None, refresh=False, dns_zone=None):
+        """ Index ``build`` makes from the zone snapshot, saved in the cache
+            as ``ext``. While the cached serial is current the saved index is
+            used as it is, without loading the zone snapshot. A ``dns_zone``
+            already fetched is indexed as it is.
+        """
+        if dns_zone is None and cache is not None and not refresh:
+            if cache.serial(self.zone, self.nameserver) is not None:
+                index = self.saved_index(ext, cache, self.get_serial())
+                if index is not None:
+                    return index
+
+        if dns_zone is None:
+            dns_zone = self.fetch_zone(cache=cache, refresh=refresh)
+        return self.indexed(ext, build, dns_zone, cache)
+
+    def saved_index(self, ext, cache, serial):
+        """ The index saved as ``ext``, while the cached snapshot is at the live ``serial`` """
+        if cache.serial(self.zone, self.nameserver) != serial:
+            return None
+        index = cache.load_index(self.zone, self.nameserver, serial, ext=ext)
+        return index if getattr(index, "format", None) == INDEX_FORMAT else None
+
+    def indexed(self, ext, build, dns_zone, cache):
+        with metrics.phase("index"):
+            index = build(dns_zone)
+        if cache is not None:
+            cache.save_index(self.zone, self.nameserver, index, ext=ext)
+        return index
+
+    def import_records(self, cache=None, refresh=False, incremental=True):
+        return list(self.iter_records(cache=cache, refresh=refresh, incremental=incremental))
+
+    def iter_records(self, cache=None, refresh=False, incremental=True):
+        """ Like import_records, but yield the records one zone node at a time.
+            Without a cache they are read from the AXFR messages as these
+            arrive, so memory stays flat whatever the size of the zone; with
+            one, the whole zone is fetched, and saved, first.
+        """
+        if cache is None:
+            return self.stream_records()
+        dns_zone = self.fetch_zone(cache=cache, refresh=refresh, incremental=incremental)
+        return self.zone_records(dns_zone)
+
+    def stream_records(self):
+        """ Records of a full transfer from the best ranked nameserver that
+            answers, failing over only until the first record is yielded
+        """
+        errors = []
+        for nameserver in self.rank_nameservers(self.nameservers()):
+            streamed = False
+            try:
+                for record in self.axfr_records(nameserver):
+                    streamed = True
+                    yield record
+                return
+            except (DNSException, OSError, EOFError) as e:
+                error = f"{nameserver}: {str(e) or e.__class__.__name__}"
+                if streamed:
+                    raise DNSException(f"Zone transfer failed part way for {self.zone} ({error})") from e
+                errors.append(error)
+        raise DNSException(f"Zone transfer failed for {self.zone} ({'; '.join(errors)})")
+
+    def axfr_records(self, nameserver):
+        """ Record of every node of an AXFR. The rrsets of a name are taken
+            to arrive together, as BIND and other servers send them
+        """
+        origin = dns.name.from_text(self.zone)
+        name, rrsets, count, size = None, [], 0, 0
+        for message in dns.query.xfr(nameserver, self.zone, port=self.port, lifetime=self.lifetime):
+            # the wire a message was parsed from, without its TCP length prefix
+            size += len(message.wire or b"")
+            for rrset in message.answer:
+                if rrset.name != name:
+                    record = self.node_to_record(name, rrsets, origin=origin) if rrsets else None
+                    if record is not None:
+                        count += 1
+                        yield record
+                    name, rrsets = rrset.name, []
+                rrsets.append(rrset)
+        record = self.node_to_record(name, rrsets, origin=origin) if rrsets else None
+        if record is not None:
+            count += 1
+            yield record
+        metrics.add("transfer", bytes=size, records=count)
+
+    def zone_records(self, dns_zone):
         for name, node in dns_zone.nodes.items():
-            todict = {}
-            for rdataset in node.rdatasets:
-                for rdata in rdataset:
-                    if rdataset.rdtype in (
-                            dns.rdatatype.A, 
-                            dns.rdatatype.CNAME, 
-                            dns.rdatatype.MX,
-                    ):
-                        todict["zone"] = self.zone  
-                        todict["name"] = str(name)
-                        todict["content"] = rdata.to_text()                
-                        todict["rtype"] = dns.rdatatype.to_text(rdataset.rdtype)
-                        todict["ttl"] = rdataset.ttl                            
-                        todict["representation"] = str(rdataset)
-            
+            todict = self.node_to_record(name, node.rdatasets, origin=dns_zone.origin)
             if not todict: continue
 
-            records.append(todict)
-        return records
-      
+            yield todict
+
+    @metrics.timed("lookup")
+    def lookup_records(self, name, rtype=None):
+        """ Query the nameserver for a single name instead of transferring the whole zone.
+            Returns the same record layout as import_records for that name.
+        """
+        exchanges = self.exchange(self.lookup_queries(name, rtype))
+        if any(exchange is None for exchange in exchanges):
+            raise DNSException(self.udp_error)
+        return self.lookup_result(name, [exchange.response for exchange in exchanges])
+
+    def lookup_queries(self, name, rtype=None):
+        qname = dns.name.from_text(name, origin=dns.name.from_text(self.zone))
+        if rtype:
+            rdtypes = (dns.rdatatype.from_text(rtype),)
+        else:
+            # a CNAME is answered for either query, so A and MX cover RECORD_TYPES
+            rdtypes = (dns.rdatatype.A, dns.rdatatype.MX)
+        return [
+            dns.message.make_query(qname, rdtype)
+            for rdtype in rdtypes if rdtype in RECORD_TYPES
+        ]
+
+    def lookup_result(self, name, responses):
+        origin = dns.name.from_text(self.zone)
+        qname = dns.name.from_text(name, origin=origin)
+        rdatasets = {}
+        for response in responses:
+            # NXDOMAIN is a name with no records, any other error is no answer at all
+            if response.rcode() not in (dns.rcode.NOERROR, dns.rcode.NXDOMAIN):
+                raise DNSException(
+                    f"Lookup of {qname} failed on {self.nameserver} ({dns.rcode.to_text(response.rcode())})"
+                )
+            for rrset in response.answer:
+                if rrset.name == qname and rrset.rdtype in RECORD_TYPES:
+                    rdatasets.setdefault(rrset.rdtype, rrset.to_rdataset())
+
+        todict = self.node_to_record(qname.relativize(origin), rdatasets.values(), origin=origin)
+        return [todict] if todict else []
+
+    def node_to_record(self, name, rdatasets, origin=None):
+        """ Record of a zone node: its last RECORD_TYPES rdataset, with the
+            last rdata as content, or None when it has none
+        """
+        last = None
+        for rdataset in rdatasets:
+            if rdataset.rdtype in RECORD_TYPES and len(rdataset):
+                last = rdataset
+        if last is None:
+            return None
+
+        *others, rdata = (rdata.to_text(origin=origin, relativize=True) for rdata in last)
+        return Record(self.zone, str(name), rdata, last.rdtype, last.ttl, others=others)
+
+    def exchange(self, messages):
+        """ An Exchange for every message sent over the transport, or None
+            for one the "udp" transport could not carry
+        """
+        updates = [message for message in messages if message.opcode() == dns.opcode.UPDATE]
+        if self.transport == "tcp" or any(update.prerequisite for update in updates) or (
+            self.transport == "auto" and len(updates) > 1
+        ):
+            # the UPDATEs of a batch are applied in order (plan.diff deletes before
+            # it adds), and a retransmitted prerequisite UPDATE would fail once the
+            # first copy is applied: the TCP pipeline carries both
+            return self.connection.exchange(messages, timeout=self.timeout)
+
+        exchanges = udp_exchange(
+            messages, self.address, port=self.port, timeout=self.timeout, payload=self.payload,
+            # one UPDATE after another, queries all at once
+            depth=1 if updates else len(messages) or 1
+        )
+        left = [message for message, exchange in zip(messages, exchanges) if exchange is None]
+        if left and self.transport == "auto":
+            # too large for a datagram or answered truncated, like dns.query.udp_with_fallback
+            retried = iter(self.connection.exchange(left, timeout=self.timeout))
+            exchanges = [next(retried) if exchange is None else exchange for exchange in exchanges]
+        return exchanges
+
+    @property
+    def udp_error(self):
+        return (
+            f"Message too large for UDP, or answered truncated, by {self.nameserver}; "
+            "use the auto or tcp transport"
+        )
 
     def handler(self, data):
-        err = True
+        return self.handler_many([data])[0]
+
+    def handler_many(self, messages):
+        """ Send messages over the transport, pipelined, and return a
+            Result for each of them
+        """
         try:
-            result = dns.query.tcp(data, self.nameserver, timeout=self.timeout)
-            self.process_result = str(result)
-            response = str(result).split("\n")[2].split(" ")[1]
-            err = False
-        except dns.tsig.PeerBadKey as e:
+            with metrics.phase("update"):
+                exchanges = self.exchange(messages)
+        except dns.tsig.PeerError as e:
+            results = [self.peer_error(e)] * len(messages)
+        else:
+            metrics.add("update", bytes=sum(
+                exchange.request_size + exchange.response_size for exchange in exchanges if exchange
+            ))
+            results = [
+                Result(
+                    rcode=exchange.response.rcode(),
+                    elapsed=exchange.elapsed,
+                    request_size=exchange.request_size,
+                    response_size=exchange.response_size,
+                    nameserver=self.nameserver,
+                    response=exchange.response
+                )
+                if exchange is not None else Result(error=self.udp_error, nameserver=self.nameserver)
+                for exchange in exchanges
+            ]
+        if results:
+            self.last_result = results[-1]
+        return results
+
+    def peer_error(self, e):
+        if isinstance(e, dns.tsig.PeerBadKey):
             response = "Looks like you have a wrong key to be used to communicate with DNS Server [BADKEY]"
-        except dns.tsig.PeerBadTime as e:
+        elif isinstance(e, dns.tsig.PeerBadTime):
             response = "Looks like you have unsynchronized datetime on DNS Server [BADTIME]"
-        except dns.tsig.PeerBadSignature as e:
+        elif isinstance(e, dns.tsig.PeerBadSignature):
             response = "Looks like you have wrong signature to communite with DNS Server [BADSIGNATURE]"
-        except dns.tsig.PeerError as e:
+        else:
             response = str(e)
-        finally:
-            return response, err
+        return Result(error=response, nameserver=self.nameserver)
     
     def validate_rtype(self, rtype):
         rtype = dns.rdatatype.from_text(rtype)
-        if rtype in (
-            dns.rdatatype.A,
-            dns.rdatatype.CNAME,
-            dns.rdatatype.PTR,
-            dns.rdatatype.MX,
-            dns.rdatatype.TXT,
-            dns.rdatatype.SRV
-        ):
+        if rtype in SUPPORTED_TYPES:
             return rtype
         else:
             err = ValueError(f"DNS Service are not supported for this kind record type {rtype}")
-            raise err
\ No newline at end of file
+            raise err
+
+
+class AsyncDNSService(DNSService):
+    """ DNSService with coroutines for add_record, update_record, remove_record,
+        lookup_records, import_records and the indexes, and an asynchronous
+        generator for iter_records, built on dnspython's asyncio support.
+
+        Every instance talking to the same nameserver shares one semaphore,
+        so no more than ``limit`` requests are in flight against it however
+        many zones are driven concurrently.
+
+        >>>
+        async with AsyncDNSService(zone, nameserver, keyring_name, keyring_value) as service:
+            results = await asyncio.gather(*(
+                service.add_record(name, content, "A") for name, content in records
+            ))
+    """
+
+    # event loop -> nameserver -> semaphore, since a semaphore belongs to one loop
+    semaphores = weakref.WeakKeyDictionary()
+
+    def __init__(self, zone, nameserver, keyring_name, keyring_value, timeout=10, lifetime=None, port=53,
+                 transport="auto", payload=DEFAULT_PAYLOAD, limit=MAX_IN_FLIGHT):
+        super().__init__(
+            zone, nameserver, keyring_name, keyring_value,
+            timeout=timeout, lifetime=lifetime, port=port, transport=transport, payload=payload
+        )
+        self.limit = limit
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    @property
+    def semaphore(self):
+        semaphores = self.semaphores.setdefault(asyncio.get_running_loop(), {})
+        if self.nameserver not in semaphores:
+            semaphores[self.nameserver] = asyncio.Semaphore(self.limit)
+        return semaphores[self.nameserver]
+
+    async def add_record(self, name, content, rtype, ttl=300, prerequisite=None):
+        return await self.handler(self.add_message(name, content, rtype, ttl, prerequisite))
+
+    async def update_record(self, name, content, rtype, ttl=300):
+        return await self.handler(self.update_message(name, content, rtype, ttl))
+
+    async def remove_record(self, name, rtype=None):
+        return await self.handler(self.remove_message(name, rtype))
+
+    async def apply_changes(self, changes):
+        return await self.handler_many(list(self.batch_updates(changes, max_size=self.max_update_size)))
+
+    async def apply_records(self, records, replace=True):
+        return await self.apply_changes(group_records(records, "replace" if replace else "add"))
+
+    async def nameserver_address(self):
+        """ The address property, resolved without blocking the event loop """
+        return await registry.async_address(self.nameserver)
+
+    async def get_serial(self):
+        serial, _ = await self.probe(await self.nameserver_address())
+        return serial
+
+    async def probe(self, nameserver):
+        query = dns.message.make_query(self.zone, dns.rdatatype.SOA)
+        async with self.semaphore:
+            start = time.monotonic()
+            response = await dns.asyncquery.udp(query, nameserver, port=self.port, timeout=self.timeout)
+            rtt = time.monotonic() - start
+        return self.soa_serial(response), rtt
+
+    async def nameservers(self):
+        address = await self.nameserver_address()
+        try:
+            resolver = self.resolver(dns.asyncresolver.Resolver, address=address)
+            answer = await resolver.resolve(self.zone, "NS", lifetime=self.lifetime)
+        except (DNSException, ValueError):
+            return [address]
+        answers = await asyncio.gather(*(
+            self.resolve_address(resolver, rdata.target) for rdata in answer
+        ), return_exceptions=True)
+        addresses = [
+            str(address)
+            for answer in answers if not isinstance(answer, Exception)
+            for address in answer
+        ]
+        return list(OrderedDict.fromkeys(addresses)) or [address]
+
+    async def resolve_address(self, resolver, target):
+        try:
+            return await resolver.resolve(target, "A", lifetime=self.lifetime)
+        except DNSException:
+            return await dns.asyncresolver.resolve(target, "A", lifetime=self.lifetime)
+
+    async def rank_nameservers(self, nameservers, cache=None):
+        rtts = cache.rtts(nameservers) if cache is not None else {}
+        results = await asyncio.gather(*(
+            self.probe(nameserver) for nameserver in nameservers
+        ), return_exceptions=True)
+        probes = {
+            nameserver: result
+            for nameserver, result in zip(nameservers, results)
+            if not isinstance(result, Exception)
+        }
+        remember_rtts(cache, probes, rtts)
+        return order_nameservers(nameservers, probes, rtts)
+
+    async def transfer_zone(self, dns_zone=None, cache=None):
+        errors = []
+        for nameserver in await self.rank_nameservers(await self.nameservers(), cache=cache):
+            try:
+                return await self.xfr(nameserver, dns_zone)
+            except (DNSException, OSError, EOFError) as e:
+                errors.append(f"{nameserver}: {str(e) or e.__class__.__name__}")
+                if cache is not None:
+                    cache.forget_rtt(nameserver)
+        raise DNSException(f"Zone transfer failed for {self.zone} ({'; '.join(errors)})")
+
+    @metrics.timed("transfer")
+    async def xfr(self, nameserver, dns_zone=None):
+        if dns_zone is not None:
+            try:
+                query, _ = dns.xfr.make_query(dns_zone, serial=dns_zone.get_soa().serial)
+                async with self.semaphore:
+                    await dns.asyncquery.inbound_xfr(
+                        nameserver, dns_zone, query,
+                        port=self.port,
+                        timeout=self.timeout,
+                        lifetime=self.lifetime
+                    )
+                return dns_zone
+            except IXFR_FALLBACK_ERRORS:
+                pass
+        dns_zone = dns.zone.Zone(self.zone)
+        query, _ = dns.xfr.make_query(dns_zone, serial=None)
+        async with self.semaphore:
+            await dns.asyncquery.inbound_xfr(
+                nameserver, dns_zone, query,
+                port=self.port,
+                timeout=self.timeout,
+                lifetime=self.lifetime
+            )
+        return dns_zone
+
+    async def fetch_zone(self, cache=None, refresh=False, incremental=True):
+        snapshot = None
+        if cache is not None and not refresh:
+            serial = cache.serial(self.zone, self.nameserver)
+            if serial is not None:
+                snapshot = cache.load(self.zone, self.nameserver)
+                if snapshot is not None and serial == await self.get_serial():
+                    return snapshot
+
+        dns_zone = await self.transfer_zone(snapshot if incremental else None, cache=cache)
+        metrics.add("transfer", records=len(dns_zone.nodes))
+        if cache is not None:
+            cache.save(self.zone, self.nameserver, dns_zone)
+        return dns_zone
+
+    async def import_records(self, cache=None, refresh=False, incremental=True):
+        dns_zone = await self.fetch_zone(cache=cache, refresh=refresh, incremental=incremental)
+        return list(self.zone_records(dns_zone))
+
+    async def iter_records(self, cache=None, refresh=False, incremental=True):
+        """ Asynchronous generator of the records, for ``async for`` """
+        dns_zone = await self.fetch_zone(cache=cache, refresh=refresh, incremental=incremental)
+        for record in self.zone_records(dns_zone):
+            yield record
+
+    def stream_records(self):
+        raise NotImplementedError("AsyncDNSService.iter_records fetches the zone before it yields records")
+
+    async def ip_index(self, cache=None, refresh=False, dns_zone=None):
+        return await self.zone_index("ipindex", self.build_ip_index, cache=cache, refresh=refresh, dns_zone=dns_zone)
+
+    async def name_index(self, cache=None, refresh=False, dns_zone=None):
+        return await self.zone_index("nameindex", self.build_name_index, cache=cache, refresh=refresh, dns_zone=dns_zone)
+
+    async def zone_index(self, ext, build, cache=None, refresh=False, dns_zone=None):
+        if dns_zone is None and cache is not None and not refresh:
+            if cache.serial(self.zone, self.nameserver) is not None:
+                index = self.saved_index(ext, cache, await self.get_serial())
+                if index is not None:
+                    return index
+
+        if dns_zone is None:
+            dns_zone = await self.fetch_zone(cache=cache, refresh=refresh)
+        return self.indexed(ext, build, dns_zone, cache)
+
+    async def lookup_records(self, name, rtype=None):
+        responses = await asyncio.gather(*(
+            self.query(query) for query in self.lookup_queries(name, rtype)
+        ))
+        return self.lookup_result(name, responses)
+
+    async def query(self, query):
+        async with self.semaphore:
+            return await self.send(query)
+
+    async def send(self, message):
+        """ Response to ``message`` over the transport, with dnspython's
+            single datagram and no retransmit for UDP
+        """
+        address = await self.nameserver_address()
+        # prerequisite UPDATEs over TCP, as in DNSService.exchange
+        if self.transport != "tcp" and not getattr(message, "prerequisite", None):
+            if message.edns < 0:
+                message.use_edns(0, payload=self.payload, request_payload=65535)
+            if self.transport == "udp":
+                return await dns.asyncquery.udp(message, address, port=self.port, timeout=self.timeout)
+            if len(message.to_wire()) <= self.payload:
+                response, _ = await dns.asyncquery.udp_with_fallback(
+                    message, address, port=self.port, timeout=self.timeout
+                )
+                return response
+        return await dns.asyncquery.tcp(message, address, port=self.port, timeout=self.timeout)
+
+    @metrics.timed("update")
+    async def handler(self, data):
+        """ Wire sizes are not reported, as dns.asyncquery renders the message itself """
+        try:
+            async with self.semaphore:
+                response = await self.send(data)
+        except dns.tsig.PeerError as e:
+            result = self.peer_error(e)
+        else:
+            result = Result(
+                rcode=response.rcode(),
+                elapsed=response.time,
+                nameserver=self.nameserver,
+                response=response
+            )
+        self.last_result = result
+        return result
+
+    async def handler_many(self, messages):
+        """ One message after another, so the UPDATEs of a batch are applied in order """
+        return [await self.handler(data) for data in messages]
+
+    def exchange(self, messages):
+        raise NotImplementedError("AsyncDNSService sends its messages with the handler coroutine")
@@ -0,0 +1,167 @@
+import bisect
+import fnmatch
+import ipaddress
+from array import array
+
+import dns.exception
+import dns.rdatatype
+import dns.reversename
+
+from dnsmanager.records import Record
+
+# record types whose addresses go in the IPIndex
+ADDRESS_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+# ways a NameIndex matches a pattern against record names
+MATCH_MODES = ("exact", "prefix", "suffix", "glob", "substring")
+
+# bumped whenever the indexes change shape, so saved ones are rebuilt
+INDEX_FORMAT = 3
+
+# sorts after any character a record name can hold
+HIGHEST = "\U0010ffff"
+
+
+def parse_network(content):
+    """ The address or CIDR range ``content`` stands for, or None when it is neither """
+    try:
+        return ipaddress.ip_network(content, strict=False)
+    except (TypeError, ValueError):
+        return None
+
+def prefix_range(keys, prefix):
+    """ Positions of the sorted ``keys`` starting with ``prefix`` """
+    start = bisect.bisect_left(keys, prefix)
+    return start, bisect.bisect_left(keys, prefix + HIGHEST, lo=start)
+
+def literal_ends(pattern):
+    """ The literal prefix and suffix of a glob pattern around its wildcards """
+    positions = [index for index, char in enumerate(pattern) if char in "*?["]
+    if not positions:
+        return pattern, pattern
+    return pattern[:positions[0]], pattern[positions[-1] + 1:]
+
+
+class IPIndex(object):
+    """ Addresses of one zone snapshot, for exact address and CIDR range lookups.
+
+        A and AAAA contents, and the addresses that the PTR records of a
+        reverse zone stand for, are kept as integers in sorted arrays next
+        to their records, so a lookup is two binary searches. IPv4 keys sit
+        in a compact ``array``; IPv6 keys are too wide for one and stay a
+        sorted list of ints.
+    """
+
+    def __init__(self, zone, serial, entries=()):
+        self.zone = zone
+        self.serial = serial
+        self.format = INDEX_FORMAT
+        self.v4_keys, self.v4_records = array("L"), []
+        self.v6_keys, self.v6_records = [], []
+        for key, version, record in sorted(entries, key=lambda entry: (entry[1], entry[0])):
+            if version == 4:
+                self.v4_keys.append(key)
+                self.v4_records.append(record)
+            else:
+                self.v6_keys.append(key)
+                self.v6_records.append(record)
+
+    def __len__(self):
+        return len(self.v4_records) + len(self.v6_records)
+
+    @classmethod
+    def from_zone(cls, zone, dns_zone):
+        origin = dns_zone.origin
+        entries = []
+        for name, node in dns_zone.nodes.items():
+            for rdataset in node.rdatasets:
+                if rdataset.rdtype in ADDRESS_TYPES:
+                    for rdata in rdataset:
+                        address = ipaddress.ip_address(rdata.address)
+                        entries.append((
+                            int(address), address.version,
+                            Record(zone, str(name), rdata.address, rdataset.rdtype, rdataset.ttl)
+                        ))
+                elif rdataset.rdtype == dns.rdatatype.PTR:
+                    try:
+                        address = ipaddress.ip_address(
+                            dns.reversename.to_address(name.derelativize(origin))
+                        )
+                    except (dns.exception.SyntaxError, ValueError):
+                        continue
+                    for rdata in rdataset:
+                        content = rdata.to_text(origin=origin, relativize=True)
+                        entries.append((
+                            int(address), address.version,
+                            Record(zone, str(name), content, rdataset.rdtype, rdataset.ttl)
+                        ))
+        return cls(zone, dns_zone.get_soa().serial, entries)
+
+    def search(self, network, rtype=None):
+        """ Records whose address is in ``network`` (an address or CIDR range), in address order """
+        if not isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+            network = ipaddress.ip_network(network, strict=False)
+        if network.version == 4:
+            keys, records = self.v4_keys, self.v4_records
+        else:
+            keys, records = self.v6_keys, self.v6_records
+
+        start = bisect.bisect_left(keys, int(network.network_address))
+        stop = bisect.bisect_right(keys, int(network.broadcast_address), lo=start)
+        return [record for record in records[start:stop] if rtype is None or record.rtype == rtype]
+
+
+class NameIndex(object):
+    """ Records of one zone snapshot by name, for find without a scan of the zone.
+
+        Names are kept lowercased in two sorted lists, as they are and
+        reversed, so an exact or prefix match is a binary search on the
+        first and a suffix match one on the second. A glob is narrowed to
+        the smaller range its literal prefix or suffix selects before
+        the pattern is checked; only substring matches read every name.
+    """
+
+    def __init__(self, zone, serial, records=()):
+        self.zone = zone
+        self.serial = serial
+        self.format = INDEX_FORMAT
+        self.records = sorted(records, key=lambda record: record.name.lower())
+        self.names = [record.name.lower() for record in self.records]
+        reversed_names = sorted((name[::-1], position) for position, name in enumerate(self.names))
+        self.reversed_names = [name for name, _ in reversed_names]
+        self.reversed_positions = array("L", (position for _, position in reversed_names))
+
+    def __len__(self):
+        return len(self.records)
+
+    def forward(self, prefix):
+        start, stop = prefix_range(self.names, prefix)
+        return range(start, stop)
+
+    def backward(self, suffix):
+        start, stop = prefix_range(self.reversed_names, suffix[::-1])
+        return self.reversed_positions[start:stop]
+
+    def positions(self, pattern, match):
+        if match == "exact":
+            start = bisect.bisect_left(self.names, pattern)
+            return range(start, bisect.bisect_right(self.names, pattern, lo=start))
+        if match == "prefix":
+            return self.forward(pattern.rstrip("*"))
+        if match == "suffix":
+            return sorted(self.backward(pattern.lstrip("*")))
+        if match == "glob":
+            prefix, suffix = literal_ends(pattern)
+            candidates = min(self.forward(prefix), self.backward(suffix), key=len)
+            return sorted(
+                position for position in candidates
+                if fnmatch.fnmatchcase(self.names[position], pattern)
+            )
+        if match == "substring":
+            return [position for position, name in enumerate(self.names) if pattern in name]
+        raise ValueError(f"Unknown match mode ({match}), expected one of {', '.join(MATCH_MODES)}")
+
+    def search(self, pattern, match="exact", rtype=None):
+        """ Records whose name matches ``pattern`` the ``match`` way, in name order """
+        records = (self.records[position] for position in self.positions(pattern.lower(), match))
+        return [record for record in records if rtype is None or record.rtype == rtype]
@@ -0,0 +1,67 @@
+from collections import OrderedDict
+
+
+class Manifest(object):
+    """ Desired zones and records, as described in a composer.yaml file
+
+        >>>
+        version: 1
+        zones:
+          - name: dev1.local
+            server: 10.0.0.53
+            keyring_name: rndc-key
+            keyring_value: RNjdakslakvaXlks==
+        records:
+          defaults:
+            rtype: A
+            ttl: 300
+          items:
+            - name: cute-app-1
+              content: 192.168.1.1
+              zone: dev1.local
+    """
+
+    def __init__(self, zones=None, records=None, defaults=None):
+        self.zones = OrderedDict((zone["name"], zone) for zone in zones or [])
+        self.defaults = defaults or {}
+        self.records = [self.parse_record(record) for record in records or []]
+
+    @classmethod
+    def load(cls, stream):
+        import yaml
+        try:
+            data = yaml.safe_load(stream) or {}
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid manifest: {e}")
+        if not isinstance(data, dict):
+            raise ValueError("Manifest must be a mapping with 'zones' and 'records'")
+
+        records = data.get("records") or {}
+        if isinstance(records, list):
+            defaults, items = {}, records
+        else:
+            defaults, items = records.get("defaults") or {}, records.get("items") or []
+        return cls(zones=data.get("zones"), records=items, defaults=defaults)
+
+    def parse_record(self, record):
+        record = dict(self.defaults, **record)
+        if not record.get("zone") and len(self.zones) == 1:
+            record["zone"] = next(iter(self.zones))
+
+        # a ttl of 0 is a valid one
+        missing = [key for key in ("name", "content", "rtype", "ttl", "zone") if record.get(key) in (None, "")]
+        if missing:
+            raise ValueError(f"Record {record.get('name', '?')} is missing {', '.join(missing)}")
+        record["rtype"] = str(record["rtype"]).upper()
+        record["ttl"] = int(record["ttl"])
+        record["content"] = str(record["content"])
+        return record
+
+    def zone(self, name):
+        return self.zones.get(name)
+
+    def records_by_zone(self):
+        grouped = OrderedDict()
+        for record in self.records:
+            grouped.setdefault(record["zone"], []).append(record)
+        return grouped
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import fcntl
+import inspect
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import OrderedDict
+
+# counters kept for every phase
+FIELDS = ("calls", "seconds", "bytes", "records")
+
+
+class Metrics(object):
+    """ Per-phase durations, bytes transferred and record counts of this process.
+
+        Phases recorded from several threads (e.g. zones searched concurrently)
+        add up, so their seconds can exceed the wall clock time.
+
+        >>>
+        with metrics.phase("transfer"):
+            ...
+        metrics.add("transfer", records=1200)
+        print(metrics.to_json())
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = OrderedDict()
+
+    def add(self, name, calls=0, seconds=0.0, bytes=0, records=0):
+        with self.lock:
+            entry = self.phases.setdefault(name, dict.fromkeys(FIELDS, 0))
+            entry["calls"] += calls
+            entry["seconds"] += seconds
+            entry["bytes"] += bytes
+            entry["records"] += records
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, calls=1, seconds=time.perf_counter() - start)
+
+    def timed(self, name):
+        """ Decorator recording every call of a function, or coroutine function, as ``name`` """
+        def decorator(func):
+            if inspect.iscoroutinefunction(func):
+                @wraps(func)
+                async def wrapper(*args, **kwargs):
+                    with self.phase(name):
+                        return await func(*args, **kwargs)
+            else:
+                @wraps(func)
+                def wrapper(*args, **kwargs):
+                    with self.phase(name):
+                        return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+
+    def to_dict(self):
+        with self.lock:
+            return OrderedDict((name, dict(entry)) for name, entry in self.phases.items())
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def to_prometheus(self, previous=None):
+        """ Prometheus text exposition of the counters, added to ``previous`` samples """
+        samples = OrderedDict(previous or {})
+        for name, entry in self.to_dict().items():
+            for field in FIELDS:
+                key = f'dnsmanager_phase_{field}_total{{phase="{name}"}}'
+                samples[key] = samples.get(key, 0) + entry[field]
+
+        lines = []
+        for field in FIELDS:
+            metric = f"dnsmanager_phase_{field}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.extend(
+                f"{key} {value:g}" for key, value in samples.items()
+                if key.split("{", 1)[0] == metric
+            )
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """ Add this process' counters to a node_exporter textfile collector file.
+
+            The read and the write are done under a lock on ``<path>.lock``,
+            so commands finishing together do not lose each other's counts.
+        """
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            previous = OrderedDict()
+            try:
+                with open(path, "r") as f:
+                    for line in f:
+                        if line.startswith("#") or not line.strip():
+                            continue
+                        key, _, value = line.rstrip("\n").rpartition(" ")
+                        previous[key] = float(value)
+            except (OSError, ValueError):
+                previous = None
+
+            # written aside and renamed, so the collector never reads a partial file
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(self.to_prometheus(previous))
+            os.replace(tmp, path)
+
+    def report(self):
+        """ Rows of the phase breakdown: phase, calls, seconds, records, bytes """
+        return [
+            [name, entry["calls"], f"{entry['seconds']:.3f}", entry["records"], entry["bytes"]]
+            for name, entry in self.to_dict().items()
+        ]
+
+
+metrics = Metrics()
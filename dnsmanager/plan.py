@@ -0,0 +1,92 @@
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+
+from dnsmanager.core import SUPPORTED_TYPES
+
+
+def index_zone(dns_zone, rtypes=SUPPORTED_TYPES):
+    """ Map (name, rdtype) -> (ttl, contents) for the RRsets of a live zone """
+    origin = dns_zone.origin
+    index = {}
+    for name, node in dns_zone.nodes.items():
+        for rdataset in node.rdatasets:
+            if rdataset.rdtype not in rtypes:
+                continue
+            index[(name, rdataset.rdtype)] = (
+                rdataset.ttl,
+                frozenset(rdata.to_text(origin=origin, relativize=True) for rdata in rdataset)
+            )
+    return index
+
+def index_records(records, origin):
+    """ Map (name, rdtype) -> (ttl, contents) for desired records, in the same form as index_zone """
+    index = {}
+    for record in records:
+        rdtype = dns.rdatatype.from_text(record["rtype"])
+        name = dns.name.from_text(record["name"], origin=origin).relativize(origin)
+        rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype, record["content"], origin=origin)
+        ttl, contents = index.get((name, rdtype), (record["ttl"], set()))
+        contents.add(rdata.to_text(origin=origin, relativize=True))
+        index[(name, rdtype)] = (min(ttl, record["ttl"]), contents)
+    return index
+
+def protected_names(dns_zone):
+    """ The apex and in-zone nameserver names, which a prune must never touch """
+    origin = dns_zone.origin
+    names = {dns.name.empty}
+    rdataset = dns_zone.get_rdataset(dns.name.empty, dns.rdatatype.NS)
+    for rdata in rdataset or []:
+        target = rdata.target.derelativize(origin)
+        if target.is_subdomain(origin):
+            names.add(target.relativize(origin))
+    return names
+
+def change(action, key, ttl, contents, current=()):
+    name, rdtype = key
+    return {
+        "action": action,
+        "name": str(name),
+        "rtype": dns.rdatatype.to_text(rdtype),
+        "ttl": ttl,
+        "content": sorted(contents),
+        "current": sorted(current),
+    }
+
+def diff(live, desired, replace=True, prune=False, protected=()):
+    """ The RRset changes that turn ``live`` into ``desired``, both built by index_*.
+
+        With ``replace`` an RRset whose contents or TTL differ is replaced,
+        otherwise only its missing records are added. With ``prune`` RRsets
+        that are not desired are deleted, except for ``protected`` names.
+        Deletes come first so a name can change type within one batch.
+    """
+    deletes, replaces, adds = [], [], []
+    for key, (ttl, contents) in desired.items():
+        current = live.get(key)
+        if current is None:
+            adds.append(change("add", key, ttl, contents))
+        elif replace:
+            if current[0] != ttl or current[1] != contents:
+                replaces.append(change("replace", key, ttl, contents, current[1]))
+        else:
+            missing = contents - current[1]
+            if missing:
+                adds.append(change("add", key, ttl, missing, current[1]))
+
+    if prune:
+        for key, (ttl, contents) in live.items():
+            if key not in desired and key[0] not in protected:
+                deletes.append(change("delete", key, ttl, (), contents))
+    return deletes + replaces + adds
+
+def plan_zone(dns_zone, records, replace=True, prune=False):
+    live = index_zone(dns_zone)
+    desired = index_records(records, dns_zone.origin)
+    return diff(
+        live, desired,
+        replace=replace,
+        prune=prune,
+        protected=protected_names(dns_zone)
+    )
@@ -0,0 +1,162 @@
+import time
+import socket
+import ipaddress
+import threading
+
+import dns.exception
+import dns.resolver
+import dns.tsigkeyring
+
+from dnsmanager.connection import Connection
+
+# seconds an address is kept when its lookup gives no TTL (/etc/hosts and the like)
+DEFAULT_ADDRESS_TTL = 300
+
+# seconds allowed for resolving a nameserver hostname over DNS, when the
+# system resolver has no address for it
+RESOLVE_LIFETIME = 2.0
+
+
+class Registry(object):
+    """ Nameserver addresses, TSIG keyrings, connections and services shared
+        by every DNSService of the process.
+
+        A hostname given as a zone's server is resolved once and its address
+        kept for the TTL of the answer, a keyring is parsed once per key, and
+        the zones served from one address and port share its connection.
+        invalidate() drops what is held for a server, or everything.
+
+        >>>
+        service = registry.service("example.com", "ns1.example.com", "rndc-key", secret)
+        registry.invalidate("ns1.example.com")
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.addresses = {}
+        self.keyrings = {}
+        self.connections = {}
+        self.services = {}
+
+    def address(self, server):
+        """ Address to reach ``server`` at, which may be an address already """
+        address = self.known_address(server)
+        if address is None:
+            address = self.remember_address(server, *self.resolve(server))
+        return address
+
+    async def async_address(self, server):
+        """ Like address, without blocking the event loop on the lookup """
+        address = self.known_address(server)
+        if address is None:
+            address = self.remember_address(server, *await self.async_resolve(server))
+        return address
+
+    def known_address(self, server):
+        """ ``server`` when it is an address, or its address while it is kept, or None """
+        try:
+            ipaddress.ip_address(server)
+            return server
+        except ValueError:
+            pass
+
+        entry = self.addresses.get(server)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def remember_address(self, server, address, ttl):
+        with self.lock:
+            self.addresses[server] = (address, time.monotonic() + ttl)
+        return address
+
+    @staticmethod
+    def resolve(server):
+        """ First address of ``server`` and the seconds it may be kept.
+
+            The system resolver is asked first, so a name from /etc/hosts
+            does not wait on DNS; an A or AAAA query, which gives the TTL,
+            only when it has no answer.
+        """
+        try:
+            info = socket.getaddrinfo(server, None, type=socket.SOCK_STREAM)
+            return info[0][4][0], DEFAULT_ADDRESS_TTL
+        except socket.gaierror as e:
+            error = e
+        for rdtype in ("A", "AAAA"):
+            try:
+                answer = dns.resolver.resolve(server, rdtype, lifetime=RESOLVE_LIFETIME)
+            except dns.exception.DNSException:
+                continue
+            return str(answer[0]), answer.rrset.ttl
+        raise error
+
+    @staticmethod
+    async def async_resolve(server):
+        """ resolve, with the event loop's getaddrinfo and dnspython's async resolver """
+        import asyncio
+        import dns.asyncresolver
+
+        try:
+            info = await asyncio.get_running_loop().getaddrinfo(server, None, type=socket.SOCK_STREAM)
+            return info[0][4][0], DEFAULT_ADDRESS_TTL
+        except socket.gaierror as e:
+            error = e
+        for rdtype in ("A", "AAAA"):
+            try:
+                answer = await dns.asyncresolver.resolve(server, rdtype, lifetime=RESOLVE_LIFETIME)
+            except dns.exception.DNSException:
+                continue
+            return str(answer[0]), answer.rrset.ttl
+        raise error
+
+    def keyring(self, name, secret):
+        keyring = self.keyrings.get((name, secret))
+        if keyring is None:
+            keyring = dns.tsigkeyring.from_text({name: secret})
+            with self.lock:
+                self.keyrings[(name, secret)] = keyring
+        return keyring
+
+    def connection(self, address, port=53, timeout=10):
+        with self.lock:
+            connection = self.connections.get((address, port))
+            if connection is None:
+                connection = self.connections[(address, port)] = Connection(address, port=port, timeout=timeout)
+        return connection
+
+    def service(self, zone, nameserver, keyring_name, keyring_value, **kwargs):
+        """ The DNSService of a zone on a server with a key, made once """
+        from dnsmanager.core import DNSService
+
+        key = (zone, nameserver, keyring_name, keyring_value) + tuple(sorted(kwargs.items()))
+        with self.lock:
+            service = self.services.get(key)
+        if service is None:
+            service = DNSService(zone, nameserver, keyring_name, keyring_value, **kwargs)
+            with self.lock:
+                service = self.services.setdefault(key, service)
+        return service
+
+    def invalidate(self, server=None):
+        """ Forget the address of ``server`` and close its connections,
+            or forget everything held when no server is given
+        """
+        with self.lock:
+            if server is None:
+                addresses = None
+                self.addresses.clear()
+                self.keyrings.clear()
+                self.services.clear()
+            else:
+                entry = self.addresses.pop(server, None)
+                addresses = {server, entry[0]} if entry else {server}
+            closing = [key for key in self.connections if addresses is None or key[0] in addresses]
+            connections = [self.connections.pop(key) for key in closing]
+        for connection in connections:
+            # after any exchange in progress on it
+            with connection.lock:
+                connection.close()
+
+
+registry = Registry()
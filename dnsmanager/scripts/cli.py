@@ -1,14 +1,13 @@
 
 import os
 import click
-import configparser
 
-from dnsmanager import __version__
-from .config import ConfigFileProcessor
-from .commands import init_command
+from dnsmanager import __version__, utils
+from dnsmanager.metrics import metrics
+from .commands import init_command, LazyGroup
 
 
-@click.group(invoke_without_command=True)
+@click.group(cls=LazyGroup, invoke_without_command=True)
 @click.version_option(
     version=__version__, 
     prog_name="DNSManager",
@@ -18,13 +17,33 @@ from .commands import init_command
     type=click.File(),
     help="Selected configuration file."
 )
+@click.option("--timings",
+    is_flag=True,
+    help="Print how long each phase took at exit."
+)
+@click.option("--metrics-json", "metrics_json",
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+    help="Write per-phase durations, bytes and record counts as JSON at exit."
+)
+@click.option("--metrics-textfile", "metrics_textfile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Add per-phase metrics to a Prometheus textfile collector file at exit."
+)
+@click.option("--no-daemon", "no_daemon",
+    is_flag=True,
+    help="Run the command here even when `dnsmanager serve` is running."
+)
 @click.pass_context
-def cli(ctx, config_file):
+def cli(ctx, config_file, timings, metrics_json, metrics_textfile, no_daemon):
     """ 
     An DNS Manager to interact with DNS Server
 
     # for now only support DNS BIND9
     """
+    import configparser
+    from .config import ConfigFileProcessor
+
+    ctx.call_on_close(lambda: emit_metrics(timings, metrics_json, metrics_textfile))
 
     cfp = ConfigFileProcessor()
     if config_file:
@@ -52,5 +71,19 @@ def cli(ctx, config_file):
     ctx.ensure_object(dict)
     ctx.obj["CONFIG"] = config
     ctx.obj["CONFIG_PATH"] = cfp.config_path
+    ctx.obj["NO_DAEMON"] = no_daemon
+
+def emit_metrics(timings, metrics_json, metrics_textfile):
+    if timings and metrics.phases:
+        output = utils.Formatter.from_arr(
+            metrics.report(),
+            headers=["PHASE", "CALLS", "SECONDS", "RECORDS", "BYTES"]
+        )
+        click.echo("\n".join(output), err=True)
+    if metrics_json:
+        with click.open_file(metrics_json, "w") as f:
+            f.write(metrics.to_json(indent=4))
+    if metrics_textfile:
+        metrics.write_textfile(metrics_textfile)
 
 init_command(cli)
\ No newline at end of file
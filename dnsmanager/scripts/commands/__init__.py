@@ -1,22 +1,45 @@
 
-AVAILABLE_COMMANDS = (
-    "find",
-    "new",
-    "update",
-    "remove",
-)
+# command name -> function in .cmd, imported the first time the command is used
+AVAILABLE_COMMANDS = {
+    "find": "find",
+    "new": "new",
+    "put": "update",
+    "rm": "remove",
+    "import": "import_records",
+    "plan": "plan",
+    "apply": "apply",
+    "serve": "serve",
+}
 
 import click
 
+class LazyGroup(click.Group):
+    """ A group whose commands are registered by import path and only
+        imported once they are looked up, so ``--version`` and ``--help``
+        do not pay for loading every command and dnspython.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lazy_commands = kwargs.pop("lazy_commands", {})
+        super().__init__(*args, **kwargs)
+
+    def add_lazy_command(self, name, import_path):
+        self.lazy_commands[name] = import_path
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            self.add_command(self.load_command(self.lazy_commands[name]), name)
+        return super().get_command(ctx, name)
+
+    @staticmethod
+    def load_command(import_path):
+        from importlib import import_module
+        module_name, attr = import_path.split(":")
+        return getattr(import_module(module_name), attr)
+
 def init_command(cli, **kwargs):
-    from importlib import import_module
-    from inspect import getmembers, isfunction
-    
-    modules = import_module(
-        f".cmd", 
-        package=__name__
-    )
-    
-    for name, func in getmembers(modules):
-        if name in AVAILABLE_COMMANDS:
-            cli.add_command(func)
+    for name, attr in AVAILABLE_COMMANDS.items():
+        cli.add_lazy_command(name, f"{__name__}.cmd:{attr}")
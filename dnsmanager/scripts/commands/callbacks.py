@@ -1,20 +1,39 @@
 
 import click
-from dnsmanager.scripts.config import ConfigFileProcessor
+
+from dnsmanager.utils import ZoneTrie
+
+def zone_trie(ctx):
+    """ ZoneTrie of the available zones, built once per invocation """
+    obj = ctx.find_root().obj
+    if "ZONES" not in obj:
+        obj["ZONES"] = ZoneTrie(obj["CONFIG"]["dns.zones"]["available"])
+    return obj["ZONES"]
 
 def check_domain(ctx, param, value):
-    value = value.split(".")
-    if len(value) > 1:
-        ctx.params["zone"] = ".".join(value[1:])
-    return value[0]
+    # the most specific configured zone the name ends with, if any,
+    # otherwise the name is taken as relative to --zone
+    zone, name = zone_trie(ctx).split(value)
+    ctx.meta["dnsmanager.fqdn"] = zone is not None
+    if zone is not None:
+        ctx.params["zone"] = zone
+    return name
+
+def check_pattern(ctx, param, value):
+    if value is None:
+        return value
+    name = check_domain(ctx, param, value)
+    # a wildcard pattern is matched as a glob even with its zone given,
+    # against the names of the index, which are relative to the zone
+    if any(char in name for char in "*?["):
+        ctx.meta["dnsmanager.fqdn"] = False
+    return name
 
 def check_availability_zone(allow_null=True):
 
     def validate(ctx, param, value):
-        config = ctx.obj["CONFIG"]
-        available_zones = config["dns.zones"]["available"]
         value = value if value else ctx.params.get("zone")
-        if value and value not in available_zones:
+        if value and value not in zone_trie(ctx):
             raise click.exceptions.BadParameter(
                 message=f"Zone ({value}) not found in configuration file ({ctx.obj['CONFIG_PATH']})",
                 param_hint=param.name
@@ -22,20 +41,12 @@ def check_availability_zone(allow_null=True):
         
         if not allow_null and value is None:
             raise click.exceptions.BadOptionUsage(
-                message=f"Zone need to be defined"
+                option_name=param.name,
+                message="Zone need to be defined, with --zone or a domain in a configured zone"
             )
         return value
     return validate
 
-def check_existing_record_with_name(name, rtype=None):
-
-    def filtering(data):
-        comparator = (name in data.get("name"))
-        if rtype:
-            comparator = comparator and data.get("rtype") == rtype
-        return comparator
-    return filtering
-
 def check_existing_record_with_content(content, rtype=None):
 
     def filtering(data):
@@ -1,32 +1,32 @@
 
 import os
-import json
 import click
 
-from dnsmanager.scripts.config import ConfigFileProcessor
 from dnsmanager.scripts.utils import (
     prompt_y_n_question,
-    Threading
+    Worker
 )
 
 from .callbacks import (
     check_domain,
+    check_pattern,
     check_availability_zone,
-    check_existing_record_with_name,
-    check_existing_record_with_content,   
-
 )
 
-from .services import init_dns_service
-from  .utils import searching_dns, show_dns
+# dnspython, the config reader and the command helpers are imported inside
+# each command, so only the command that runs pays for loading them
 
 RTYPE_CHOICES = ["A", "CNAME", "PTR", "MX", "TXT", "SRV"]
+MATCH_CHOICES = ["exact", "prefix", "suffix", "glob", "substring"]
+EXPORT_FORMATS = ["json", "ndjson"]
+FIND_FORMATS = ["table", "ndjson"]
 
 @click.command("find", help="Find available record to the zone")
-@click.argument("domain", callback=check_domain)
+@click.argument("domain", required=False, callback=check_pattern)
 @click.option("--content", 
     type=click.STRING,
-    help="Content parameter of the record"
+    help="Content parameter of the record. An address or CIDR range "
+         "(e.g. 10.20.0.0/16) is answered from the zones' IP index"
 )
 @click.option("--rtype", 
     type=click.STRING,
@@ -41,37 +41,173 @@ RTYPE_CHOICES = ["A", "CNAME", "PTR", "MX", "TXT", "SRV"]
     callback=check_availability_zone(),
     help="Selected zone. Must available in configuration file"
 )
+@click.option("--no-cache", "no_cache",
+    is_flag=True,
+    help="Always transfer the zone instead of using the local snapshot"
+)
+@click.option("--refresh",
+    is_flag=True,
+    help="Transfer the whole zone again instead of syncing the local snapshot"
+)
+@click.option("--workers",
+    default=8,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of zones transferred concurrently"
+)
+@click.option("--timeout",
+    default=30,
+    show_default=True,
+    type=click.FLOAT,
+    help="Seconds allowed for each zone before it is skipped"
+)
+@click.option("--match",
+    type=click.Choice(MATCH_CHOICES),
+    help="How the domain is matched against record names: prefix (api-*), "
+         "suffix (*.svc) and glob (web-??.*) use the zones' name index "
+         "[default: exact for a fully qualified domain, glob for a wildcard "
+         "pattern, otherwise substring]"
+)
+@click.option("--from-file", "from_file",
+    type=click.File("r"),
+    help="Look up every name or address in this file, one per line ('-' for stdin), "
+         "transferring each zone involved once"
+)
+@click.option("--format", "fmt",
+    default="table",
+    show_default=True,
+    type=click.Choice(FIND_FORMATS),
+    help="A table, or one JSON record per line as soon as each zone is searched"
+)
 @click.pass_context
-def find(ctx, domain, content, rtype, ttl, zone):
+def find(ctx, domain, content, rtype, ttl, zone, no_cache, refresh, workers, timeout, match, from_file, fmt):
+    from dnsmanager.scripts.daemon import DaemonError
+    from .services import init_zone_cache, init_daemon_client
+    from .utils import searching_dns, show_dns, echo_ndjson
+
     config = ctx.obj["CONFIG"]
     available_zones = config["dns.zones"]["available"]
-    kwargs = {
-        "config": config, 
-        "available_zones": available_zones,
-        "domain": domain, 
-        "content": content, 
-        "rtype": rtype, 
-        "ttl": ttl, 
-        "zone": zone
-    }
-
-    threading = Threading(searching_dns, **kwargs)
-    
-    progressbar = click.progressbar(threading.progress, label=f"Searching Domain ({domain})", show_eta=True) 
-    with progressbar:
-        for progress in progressbar:
-            if threading.exception:
-                raise click.ClickException(threading.exception)
-                
-            if progress is not None: 
-                result = progress
-                break
+    if from_file is not None:
+        return find_many(ctx, from_file, rtype, zone, no_cache, refresh, workers, timeout, match, fmt)
+    if domain is None:
+        raise click.UsageError("Missing argument 'DOMAIN' (or --from-file)")
+    if match is None:
+        if ctx.meta.get("dnsmanager.fqdn") and not content:
+            match = "exact"
+        elif any(char in domain for char in "*?["):
+            match = "glob"
+        else:
+            match = "substring"
+    daemon = init_daemon_client(ctx)
+    if daemon is not None:
+        try:
+            result, errors = daemon.find(
+                domain=domain, content=content, rtype=rtype, ttl=ttl, zone=zone,
+                no_cache=no_cache, refresh=refresh, workers=workers, timeout=timeout, match=match
+            )
+        except DaemonError as e:
+            raise click.ClickException(str(e))
+    else:
+        kwargs = {
+            "config": config, 
+            "available_zones": available_zones,
+            "domain": domain, 
+            "content": content, 
+            "rtype": rtype, 
+            "ttl": ttl, 
+            "zone": zone,
+            "cache": init_zone_cache(config, enabled=not no_cache),
+            "refresh": refresh,
+            "workers": workers,
+            "timeout": timeout,
+            "match": match
+        }
+
+        worker = Worker(searching_dns, **kwargs)
+
+        progressbar = click.progressbar(
+            length=1 if zone else len(available_zones),
+            label=f"Searching Domain ({domain})",
+            show_eta=True,
+            item_show_func=lambda progress: progress and f"{progress.zone} ({progress.records} records)",
+            # stdout is left to the records when they are read by another program
+            file=click.get_text_stream("stderr") if fmt == "ndjson" else None
+        )
+        try:
+            with progressbar:
+                for progress in worker.events():
+                    progressbar.update(1, current_item=progress)
+        except KeyboardInterrupt:
+            # the zones not started yet are cancelled when the search next reports
+            worker.cancel()
+            raise
+
+        try:
+            result, errors = worker.result()
+        except click.ClickException:
+            raise
+        except Exception as e:
+            raise click.ClickException(str(e))
+
+    for failed_zone, error in errors.items():
+        click.echo(f"Warning: Zone [{failed_zone}] skipped: {error}", err=True)
 
     if not result:
         click.echo(f"Warning: Domain [{domain}] are not available at the moment")
         ctx.exit(1)
 
-    show_dns(result)
+    if fmt == "ndjson":
+        echo_ndjson((None, record) for record in result)
+    else:
+        show_dns(result)
+
+def find_many(ctx, from_file, rtype, zone, no_cache, refresh, workers, timeout, match, fmt):
+    """ find --from-file: every query answered from one pass over each zone involved """
+    from dnsmanager.scripts.daemon import DaemonError
+    from .services import init_zone_cache, init_daemon_client
+    from .callbacks import zone_trie
+    from .utils import parse_queries, bulk_searching_dns, show_matches, echo_ndjson
+
+    config = ctx.obj["CONFIG"]
+    available_zones = config["dns.zones"]["available"]
+    lines = from_file.read().splitlines()
+    queries = parse_queries(lines, zone_trie(ctx), zone=zone)
+
+    daemon = init_daemon_client(ctx)
+    if daemon is not None:
+        try:
+            searched = daemon.find_many(
+                lines=lines, rtype=rtype, zone=zone, no_cache=no_cache, refresh=refresh,
+                workers=workers, timeout=timeout, match=match
+            )
+        except DaemonError as e:
+            raise click.ClickException(str(e))
+    else:
+        searched = bulk_searching_dns(
+            config, available_zones, queries, rtype=rtype, zone=zone, match=match,
+            cache=init_zone_cache(config, enabled=not no_cache), refresh=refresh,
+            workers=workers, timeout=timeout
+        )
+
+    found, matches = set(), []
+    for searched_zone, zone_matches, error in searched:
+        if error is not None:
+            click.echo(f"Warning: Zone [{searched_zone}] skipped: {error}", err=True)
+            continue
+        found.update(query for query, _ in zone_matches)
+        if fmt == "ndjson":
+            echo_ndjson(zone_matches)
+        else:
+            matches.extend(zone_matches)
+
+    if matches:
+        order = {query.text: position for position, query in enumerate(queries)}
+        show_matches(sorted(matches, key=lambda match: order[match[0]]))
+    missing = [query.text for query in queries if query.text not in found]
+    for text in missing:
+        click.echo(f"Warning: Domain [{text}] are not available at the moment", err=True)
+    if queries and len(missing) == len(queries):
+        ctx.exit(1)
 
 @click.command("new", help="New record to be added to the zone")
 @click.argument("domain", callback=check_domain)
@@ -105,11 +241,15 @@ def find(ctx, domain, content, rtype, ttl, zone):
 @click.option("-y", "--yes", is_flag=True, help="Answer yes for all prompt question")
 @click.pass_context
 def new(ctx, domain, content, rtype, ttl, force, zone, yes):
+    from dnsmanager.core import NAME_NOT_IN_USE, RRSET_NOT_EXISTS
+    from dnsmanager.scripts.config import ConfigFileProcessor
+    from .services import init_dns_service, init_daemon_client
+
     config = ctx.obj["CONFIG"]
     section = f"dns.zones.{zone}"
     zone_obj = ConfigFileProcessor.select_storage_for(section, config)
 
-    service = init_dns_service(zone_obj)
+    service = init_dns_service(zone_obj, daemon=init_daemon_client(ctx))
     rtype = rtype or zone_obj.get("rtype") or config.get("dns",{}).get("rtype")
     ttl = ttl or zone_obj.get("ttl") or config.get("dns",{}).get("ttl")
 
@@ -121,34 +261,34 @@ def new(ctx, domain, content, rtype, ttl, force, zone, yes):
         ctx.exit(0)
 
     if force:
-        result, err = service.update_record(
+        result = service.update_record(
             name=domain,
             content=content,
             rtype=rtype,
             ttl=ttl
         )
     else:    
-        data = service.import_records()
-        if data:
-            exist = list(filter(check_existing_record_with_name(domain, rtype=rtype), data))
-            if len(exist) > 0:
-                raise click.exceptions.UsageError(
-                    message=f"Record already exist [{domain}] in zone [{zone}]"
-                )
-        result, err = service.add_record(
+        # the existence check travels in the same UPDATE message as the write
+        result = service.add_record(
             name=domain,
             content=content,
             rtype=rtype,
-            ttl=ttl
+            ttl=ttl,
+            prerequisite=NAME_NOT_IN_USE if rtype == "CNAME" else RRSET_NOT_EXISTS
         )
 
-    if err: 
-        raise click.exceptions.UsageError(result)
+    if result.err: 
+        raise click.exceptions.UsageError(result.error)
 
-    if result == "NOERROR":
+    if result.rcode_text in ("YXDOMAIN", "YXRRSET"):
+        raise click.exceptions.UsageError(
+            message=f"Record already exist [{domain}] in zone [{zone}]"
+        )
+
+    if result.ok:
         click.echo(f"Successfully add record [{domain}] in zone [{zone}]")
     else:
-        click.echo(f"Error: {service.process_msg}")
+        click.echo(f"Error: {result.text}")
         ctx.exit(1)    
 
 @click.command("put", help="Put an update of the record in the zone")
@@ -177,11 +317,14 @@ def new(ctx, domain, content, rtype, ttl, force, zone, yes):
 @click.option("-y", "--yes", is_flag=True, help="Answer yes for all prompt question")
 @click.pass_context
 def update(ctx, domain, content, rtype, ttl, zone, yes):
+    from dnsmanager.scripts.config import ConfigFileProcessor
+    from .services import init_dns_service, init_daemon_client
+
     config = ctx.obj["CONFIG"]
     section = f"dns.zones.{zone}"
     zone_obj = ConfigFileProcessor.select_storage_for(section, config)
 
-    service = init_dns_service(zone_obj)
+    service = init_dns_service(zone_obj, daemon=init_daemon_client(ctx))
     rtype = rtype or zone_obj.get("rtype") or config.get("dns",{}).get("rtype")
     ttl = ttl or zone_obj.get("ttl") or config.get("dns",{}).get("ttl")
 
@@ -192,20 +335,20 @@ def update(ctx, domain, content, rtype, ttl, zone, yes):
     if not answer:
         ctx.exit(0)
     
-    result, err = service.update_record(
+    result = service.update_record(
         name=domain,
         content=content,
         rtype=rtype,
         ttl=ttl
     )
 
-    if err: 
-        raise click.exceptions.UsageError(result)
+    if result.err: 
+        raise click.exceptions.UsageError(result.error)
 
-    if result == "NOERROR":
+    if result.ok:
         click.echo(f"Successfully update record [{domain}] in zone [{zone}]")
     else:
-        click.echo(f"Error: {service.process_msg}")
+        click.echo(f"Error: {result.text}")
         ctx.exit(1)
 
 @click.command("rm", help="Delete record from the zone")
@@ -224,11 +367,14 @@ def update(ctx, domain, content, rtype, ttl, zone, yes):
 @click.option("-y", "--yes", is_flag=True, help="Answer yes for all prompt question")
 @click.pass_context
 def remove(ctx, domain, rtype, zone, yes):
+    from dnsmanager.scripts.config import ConfigFileProcessor
+    from .services import init_dns_service, init_daemon_client
+
     config = ctx.obj["CONFIG"]
     section = f"dns.zones.{zone}"
     zone_obj = ConfigFileProcessor.select_storage_for(section, config)
 
-    service = init_dns_service(zone_obj)
+    service = init_dns_service(zone_obj, daemon=init_daemon_client(ctx))
     rtype = rtype or zone_obj.get("rtype") or config.get("dns",{}).get("rtype")
 
     answer = yes or prompt_y_n_question(
@@ -238,18 +384,18 @@ def remove(ctx, domain, rtype, zone, yes):
     if not answer:
         ctx.exit(0)
 
-    result, err = service.remove_record(
+    result = service.remove_record(
         name=domain,
         rtype=rtype
     )
 
-    if err: 
-        raise click.exceptions.UsageError(result)
+    if result.err: 
+        raise click.exceptions.UsageError(result.error)
 
-    if result == "NOERROR":
+    if result.ok:
         click.echo(f"Successfully remove record [{domain}] in zone [{zone}]")
     else:
-        click.echo(f"Error: {service.process_msg}")
+        click.echo(f"Error: {result.text}")
         ctx.exit(1)
 
 @click.command("import", help="Import record from the zone")
@@ -257,16 +403,202 @@ def remove(ctx, domain, rtype, zone, yes):
 @click.option(
     "-f","--out-file", "out", 
     default="out.json", 
-    type=click.File("w"), 
+    type=click.Path(dir_okay=False, writable=True, allow_dash=True), 
     show_default=True, 
     help="Destination output file name after import record from zone"
 )
+@click.option("--format", "fmt",
+    default="json",
+    show_default=True,
+    type=click.Choice(EXPORT_FORMATS),
+    help="JSON array, or one JSON record per line"
+)
+@click.option("--gzip", "compress",
+    is_flag=True,
+    help="Compress the output file with gzip"
+)
+@click.option("--no-cache", "no_cache",
+    is_flag=True,
+    help="Always transfer the zone instead of using the local snapshot. The records "
+         "are then written as they arrive; with the snapshot, the whole zone is held "
+         "in memory first"
+)
+@click.option("--refresh",
+    is_flag=True,
+    help="Transfer the whole zone again instead of syncing the local snapshot"
+)
 @click.pass_context
-def import_records(ctx, zone, out):
+def import_records(ctx, zone, out, fmt, compress, no_cache, refresh):
+    from dns.exception import DNSException
+    from dnsmanager.scripts.config import ConfigFileProcessor
+    from dnsmanager.scripts.daemon import DaemonError
+    from .services import init_dns_service, init_zone_cache, init_daemon_client
+    from .utils import export_records
+
     config = ctx.obj["CONFIG"]
     section = f"dns.zones.{zone}"
     zone_obj = ConfigFileProcessor.select_storage_for(section, config)
-    service = init_dns_service(zone_obj)
-    result = service.import_records()
-    out.write(json.dumps(result, indent=4))
-    click.echo(f"Successfully imported {len(result)} in {os.path.realpath(out.name)}")
\ No newline at end of file
+    service = init_dns_service(zone_obj, daemon=init_daemon_client(ctx))
+    if compress and out != "-" and not out.endswith(".gz"):
+        out = f"{out}.gz"
+    try:
+        records = service.iter_records(
+            cache=init_zone_cache(config, enabled=not no_cache),
+            refresh=refresh
+        )
+        # streamed, the transfer can also fail after the first records are written
+        total = export_records(records, out, fmt=fmt, compress=compress)
+    except (DaemonError, DNSException, OSError, EOFError) as e:
+        raise click.ClickException(str(e) or e.__class__.__name__)
+    if out != "-":
+        click.echo(f"Successfully imported {total} in {os.path.realpath(out)}")
+
+@click.command("plan", help="Show the changes needed to bring the zones in line with a manifest file")
+@click.argument("manifest", 
+    default="composer.yaml",
+    type=click.File("r")
+)
+@click.option("--add-only", "add_only",
+    is_flag=True,
+    help="Only add missing records, never replace an existing record set"
+)
+@click.option("--prune",
+    is_flag=True,
+    help="Delete record sets that are not in the manifest"
+)
+@click.option("--no-cache", "no_cache",
+    is_flag=True,
+    help="Always transfer the zone instead of using the local snapshot"
+)
+@click.option("--refresh",
+    is_flag=True,
+    help="Transfer the whole zone again instead of syncing the local snapshot"
+)
+@click.pass_context
+def plan(ctx, manifest, add_only, prune, no_cache, refresh):
+    from .services import init_zone_cache
+    from .utils import load_manifest, planning_dns, show_changes
+
+    config = ctx.obj["CONFIG"]
+    manifest = load_manifest(manifest)
+    cache = init_zone_cache(config, enabled=not no_cache)
+
+    changes = []
+    for zone, records in manifest.records_by_zone().items():
+        _, zone_changes = planning_dns(
+            config, manifest, zone, records,
+            replace=not add_only, prune=prune, cache=cache, refresh=refresh
+        )
+        changes.extend(zone_changes)
+
+    if not changes:
+        click.echo("No changes. Zones are up to date with the manifest")
+        ctx.exit(0)
+
+    show_changes(changes)
+
+@click.command("apply", help="Apply the records of a manifest file to their zones")
+@click.argument("manifest", 
+    default="composer.yaml",
+    type=click.File("r")
+)
+@click.option("--add-only", "add_only",
+    is_flag=True,
+    help="Only add missing records, never replace an existing record set"
+)
+@click.option("--prune",
+    is_flag=True,
+    help="Delete record sets that are not in the manifest"
+)
+@click.option(
+    "--force", 
+    is_flag=True, 
+    help="Send every record without comparing with the zone first (cannot be used with --prune)"
+)
+@click.option("--no-cache", "no_cache",
+    is_flag=True,
+    help="Always transfer the zone instead of using the local snapshot"
+)
+@click.option("--refresh",
+    is_flag=True,
+    help="Transfer the whole zone again instead of syncing the local snapshot"
+)
+@click.option("-y", "--yes", is_flag=True, help="Answer yes for all prompt question")
+@click.pass_context
+def apply(ctx, manifest, add_only, prune, force, no_cache, refresh, yes):
+    from dns.exception import DNSException
+    from dnsmanager.core import Result, group_records
+    from .services import init_zone_cache, init_manifest_service
+    from .utils import load_manifest, planning_dns
+
+    if force and prune:
+        # pruning needs the comparison with the zone that --force skips
+        raise click.UsageError("--force cannot be used with --prune")
+
+    config = ctx.obj["CONFIG"]
+    source = manifest.name
+    manifest = load_manifest(manifest)
+    cache = init_zone_cache(config, enabled=not no_cache)
+
+    zones = manifest.records_by_zone()
+    if not zones:
+        click.echo(f"Warning: No records found in manifest ({source})")
+        ctx.exit(0)
+
+    answer = yes or prompt_y_n_question(
+        f"Do you want to apply {len(manifest.records)} records in zone [{', '.join(zones)}] ?",
+        default="no"
+    )
+    if not answer:
+        ctx.exit(0)
+
+    failed = False
+    for zone, records in zones.items():
+        try:
+            if force:
+                service = init_manifest_service(config, manifest, zone)
+                changes = group_records(records, action="add" if add_only else "replace")
+            else:
+                service, changes = planning_dns(
+                    config, manifest, zone, records,
+                    replace=not add_only, prune=prune, cache=cache, refresh=refresh
+                )
+            if not changes:
+                click.echo(f"Zone [{zone}] is up to date")
+                continue
+            results = service.apply_changes(changes)
+        except (OSError, DNSException, ValueError) as e:
+            results = [Result(error=str(e) or e.__class__.__name__)]
+
+        errors = [str(result) for result in results if not result.ok]
+        if errors:
+            failed = True
+            click.echo(f"Error: Zone [{zone}] {'; '.join(errors)}")
+        else:
+            click.echo(f"Successfully apply {len(changes)} changes "
+                       f"in {len(results)} messages in zone [{zone}]")
+
+    if failed:
+        ctx.exit(1)
+
+@click.command("serve", help="Keep services, connections and zone snapshots warm for the other commands")
+@click.option("--socket", "path",
+    type=click.Path(dir_okay=False),
+    help="Unix socket to listen on [default: $DNSMANAGER_SOCKET, the [dns] socket "
+         "option, or dnsmanager.sock in $XDG_RUNTIME_DIR or the cache directory]"
+)
+@click.pass_context
+def serve(ctx, path):
+    from dnsmanager.scripts.config import ConfigFileProcessor
+    from dnsmanager.scripts.daemon import Daemon, socket_path
+
+    config = ctx.obj["CONFIG"]
+    path = path or socket_path(config)
+    daemon = Daemon(config, ctx.obj["CONFIG_PATH"], ConfigFileProcessor)
+    click.echo(f"Serving {ctx.obj['CONFIG_PATH']} on {path}")
+    try:
+        daemon.serve_forever(path)
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        raise click.ClickException(str(e))
@@ -1,11 +1,47 @@
 
-from dnsmanager.core import DNSService
+from dnsmanager.cache import ZoneCache
+from dnsmanager.registry import registry
+from dnsmanager.scripts.config import ConfigFileProcessor
 
-def init_dns_service(zone_obj):
-    service = DNSService(
+def init_dns_service(zone_obj, daemon=None, **kwargs):
+    if daemon is not None:
+        return daemon.service(zone_obj.get("name"))
+
+    for option in ("port", "transport", "payload"):
+        kwargs.setdefault(option, zone_obj.get(option))
+    kwargs = {key: value for key, value in kwargs.items() if value is not None}
+    return registry.service(
         zone=zone_obj.get('name'),
         nameserver=zone_obj.get("server"),
         keyring_name=zone_obj.get("keyring_name"),
-        keyring_value=zone_obj.get("keyring_value")
+        keyring_value=zone_obj.get("keyring_value"),
+        **kwargs
     )
-    return service
\ No newline at end of file
+
+def init_daemon_client(ctx):
+    """ Client of the running `dnsmanager serve` for this configuration, or None """
+    obj = ctx.find_root().obj
+    if "DAEMON" not in obj:
+        from dnsmanager.scripts.daemon import DaemonClient, socket_path
+
+        obj["DAEMON"] = None
+        if not obj.get("NO_DAEMON"):
+            obj["DAEMON"] = DaemonClient.connect(socket_path(obj["CONFIG"]), obj["CONFIG_PATH"])
+    return obj["DAEMON"]
+
+def init_zone_cache(config, enabled=True):
+    if not enabled:
+        return None
+    return ZoneCache(config.get("dns", {}).get("cache_dir"))
+
+def init_manifest_service(config, manifest, zone, **kwargs):
+    section = f"dns.zones.{zone}"
+    zone_obj = dict(ConfigFileProcessor.select_storage_for(section, config) or {})
+    zone_obj.update(manifest.zone(zone) or {})
+    zone_obj.setdefault("name", zone)
+    missing = [key for key in ("server", "keyring_name", "keyring_value") if not zone_obj.get(key)]
+    if missing:
+        raise ValueError(
+            f"Zone ({zone}) needs {', '.join(missing)} in the manifest or configuration file"
+        )
+    return init_dns_service(zone_obj, **kwargs)
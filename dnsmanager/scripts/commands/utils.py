@@ -1,48 +1,303 @@
 
+import io
+import os
+import gzip
+import json
 import click
+from collections import namedtuple
 
 from dnsmanager.scripts.config import ConfigFileProcessor
 from dnsmanager import utils
-from .services import init_dns_service
-from .callbacks import (
-    check_domain,
-    check_availability_zone,
-    check_existing_record_with_name,
-    check_existing_record_with_content,   
+from dnsmanager.metrics import metrics
+from dnsmanager.manifest import Manifest
+from dnsmanager.index import parse_network
+from dnsmanager.plan import plan_zone
+from .services import init_dns_service, init_manifest_service
+from .callbacks import check_existing_record_with_content
 
-)
+# posted by searching_dns each time a zone has been searched
+SearchProgress = namedtuple("SearchProgress", ["zone", "records", "error"])
 
+# one line of a bulk find: the name or address it asks for, and the zone it is
+# limited to (None for every selected zone)
+BulkQuery = namedtuple("BulkQuery", ["text", "zone", "name", "network"])
+
+# characters that make a name a glob pattern
+WILDCARDS = "*?["
+
+@metrics.timed("format")
 def show_dns(data):
-    output = utils.Formatter.from_dict(
+    output = utils.Formatter.from_object(
         data, 
         headers=["NAME", "CONTENT", "RTYPE", "TTL", "ZONE"],
         attr=["name", "content", "rtype", "ttl", "zone"]
     )
     click.echo("\n".join(output))
 
-def searching_dns(config, available_zones, domain, content, rtype, ttl, zone):
-    data = []
-    if not zone:
-        for zone in available_zones:
-            section = f"dns.zones.{zone}"
-            zone_obj = ConfigFileProcessor.select_storage_for(section, config)
-            service = init_dns_service(zone_obj)
-            data.extend(service.import_records())
-    elif zone in available_zones:
-        section = f"dns.zones.{zone}"
-        zone_obj = ConfigFileProcessor.select_storage_for(section, config)
-        service = init_dns_service(zone_obj)
-        data.extend(service.import_records())
-    else:
+@metrics.timed("format")
+def show_matches(matches):
+    """ Table of the (query text, record) pairs of a bulk find """
+    output = utils.Formatter.from_arr(
+        [[query, record.name, record.content, record.rtype, record.ttl, record.zone] for query, record in matches],
+        headers=["QUERY", "NAME", "CONTENT", "RTYPE", "TTL", "ZONE"]
+    )
+    click.echo("\n".join(output))
+
+def echo_ndjson(matches):
+    for query, record in matches:
+        data = record.to_dict()
+        if query is not None:
+            data = dict(query=query, **data)
+        click.echo(json.dumps(data))
+
+def import_zone(config, zone, cache=None, refresh=False, timeout=None):
+    section = f"dns.zones.{zone}"
+    zone_obj = ConfigFileProcessor.select_storage_for(section, config)
+    service = init_dns_service(zone_obj, timeout=timeout, lifetime=timeout)
+    return service.import_records(cache=cache, refresh=refresh)
+
+def lookup_zone(config, zone, domain, rtype=None, timeout=None):
+    section = f"dns.zones.{zone}"
+    zone_obj = ConfigFileProcessor.select_storage_for(section, config)
+    service = init_dns_service(zone_obj, timeout=timeout)
+    return service.lookup_records(domain, rtype=rtype)
+
+def search_index(config, zone, network, rtype=None, cache=None, refresh=False, timeout=None):
+    section = f"dns.zones.{zone}"
+    zone_obj = ConfigFileProcessor.select_storage_for(section, config)
+    service = init_dns_service(zone_obj, timeout=timeout, lifetime=timeout)
+    index = service.ip_index(cache=cache, refresh=refresh)
+    with metrics.phase("filter"):
+        return len(index), index.search(network, rtype=rtype)
+
+def search_names(config, zone, pattern, match, rtype=None, cache=None, refresh=False, timeout=None):
+    section = f"dns.zones.{zone}"
+    zone_obj = ConfigFileProcessor.select_storage_for(section, config)
+    service = init_dns_service(zone_obj, timeout=timeout, lifetime=timeout)
+    index = service.name_index(cache=cache, refresh=refresh)
+    with metrics.phase("filter"):
+        return len(index), index.search(pattern, match=match, rtype=rtype)
+
+def parse_queries(lines, zones, zone=None):
+    """ BulkQuery for every non-empty line that is not a # comment.
+        ``zones`` is the ZoneTrie of the available zones.
+    """
+    queries = []
+    for line in lines:
+        text = line.strip()
+        if not text or text.startswith("#"):
+            continue
+        network = parse_network(text)
+        if network is not None:
+            queries.append(BulkQuery(text, zone, None, network))
+            continue
+        name_zone, name = zones.split(text)
+        if zone and name_zone not in (None, zone):
+            continue
+        queries.append(BulkQuery(text, name_zone or zone, name, None))
+    return queries
+
+def search_many(config, zone, queries, rtype=None, match=None, cache=None, refresh=False, timeout=None):
+    """ Answer every query against the indexes of one transfer of the zone.
+        Returns the (query text, record) pairs found.
+    """
+    section = f"dns.zones.{zone}"
+    zone_obj = ConfigFileProcessor.select_storage_for(section, config)
+    service = init_dns_service(zone_obj, timeout=timeout, lifetime=timeout)
+    names = [query for query in queries if query.network is None]
+    networks = [query for query in queries if query.network is not None]
+
+    # fetched once here unless both indexes can come from the cache as they are
+    dns_zone = None
+    if cache is None or refresh:
+        dns_zone = service.fetch_zone(cache=cache, refresh=refresh)
+
+    matches = []
+    if names:
+        index = service.name_index(cache=cache, dns_zone=dns_zone)
+        with metrics.phase("filter"):
+            for query in names:
+                mode = match or ("glob" if any(char in query.name for char in WILDCARDS) else "exact")
+                matches.extend((query.text, record) for record in index.search(query.name, match=mode, rtype=rtype))
+    if networks:
+        index = service.ip_index(cache=cache, dns_zone=dns_zone)
+        with metrics.phase("filter"):
+            for query in networks:
+                matches.extend((query.text, record) for record in index.search(query.network, rtype=rtype))
+    return matches
+
+def bulk_searching_dns(config, available_zones, queries, rtype=None, zone=None, match=None,
+                       cache=None, refresh=False, workers=8, timeout=None):
+    """ Search every zone the queries involve once, concurrently, and yield
+        (zone, [(query text, record)], error) as each one is done
+    """
+    zones = [zone] if zone else list(available_zones)
+    by_zone = {name: [] for name in zones}
+    for query in queries:
+        for name in ([query.zone] if query.zone else zones):
+            by_zone[name].append(query)
+    by_zone = {name: zone_queries for name, zone_queries in by_zone.items() if zone_queries}
+    if not by_zone:
+        return
+
+    with utils.DaemonPool(max_workers=max(1, min(workers, len(by_zone)))) as executor:
+        futures = {
+            executor.submit(search_many, config, name, zone_queries, rtype, match, cache, refresh, timeout): name
+            for name, zone_queries in by_zone.items()
+        }
+        for future in executor.as_completed(futures, timeout=timeout):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], [], str(e) or e.__class__.__name__
+
+@metrics.timed("search")
+def searching_dns(config, available_zones, domain, content, rtype, ttl, zone,
+                  cache=None, refresh=False, workers=8, timeout=None, match="substring", report=None):
+    """ Search the selected zones concurrently and filter each one as it arrives.
+
+        An exact name match is answered by querying the zone's nameserver
+        for that name, other name matches by the zones' name index and an
+        address or CIDR range content by their IP index; other content
+        searches transfer the zones.
+        Each searched zone is passed to ``report`` as a SearchProgress.
+        Returns the matching records and a dict of zone -> error message
+        for the zones that could not be searched.
+    """
+    if zone and zone not in available_zones:
         raise click.BadParameter(
-            message=f"Zone ({value}) not found in configuration file ({ctx.obj['CONFIG_PATH']})",
+            message=f"Zone ({zone}) not found in configuration file",
             param_hint="zone"
         )
-    if not data:
+    zones = [zone] if zone else list(available_zones)
+
+    if content:
+        filtering = check_existing_record_with_content(content, rtype=rtype)
+    else:
+        # an exact lookup is answered with that name and type only
+        filtering = None
+
+    lookup = match == "exact" and not content
+    network = parse_network(content) if content else None
+    indexed = not lookup and (network is not None or not content)
+    data, errors, total = [], {}, 0
+    with utils.DaemonPool(max_workers=max(1, min(workers, len(zones)))) as executor:
+        if network is not None:
+            futures = {
+                executor.submit(search_index, config, zone, network, rtype, cache, refresh, timeout): zone
+                for zone in zones
+            }
+        elif lookup:
+            futures = {
+                executor.submit(lookup_zone, config, zone, domain, rtype, timeout): zone
+                for zone in zones
+            }
+        elif not content:
+            futures = {
+                executor.submit(search_names, config, zone, domain, match, rtype, cache, refresh, timeout): zone
+                for zone in zones
+            }
+        else:
+            futures = {
+                executor.submit(import_zone, config, zone, cache, refresh, timeout): zone
+                for zone in zones
+            }
+        for future in executor.as_completed(futures, timeout=timeout):
+            zone = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                errors[zone] = str(e) or e.__class__.__name__
+                if report:
+                    report(SearchProgress(zone, 0, errors[zone]))
+                continue
+            if indexed:
+                size, matches = records
+                total += size
+                data.extend(matches)
+                if report:
+                    report(SearchProgress(zone, size, None))
+                continue
+            total += len(records)
+            with metrics.phase("filter"):
+                data.extend(filter(filtering, records))
+            metrics.add("filter", records=len(records))
+            if report:
+                report(SearchProgress(zone, len(records), None))
+
+    if not total and not errors and not lookup:
         click.echo("Error: No record data found!", err=True)
-    if content: 
-        exists = filter(check_existing_record_with_content(content, rtype=rtype), data)
-    else: 
-        exists = filter(check_existing_record_with_name(domain, rtype=rtype), data)
-    
-    return list(exists)
+    return data, errors
+
+def open_export(path, compress=False):
+    if not compress:
+        return click.open_file(path, "w")
+    if path == "-":
+        stream = gzip.GzipFile(fileobj=click.get_binary_stream("stdout"), mode="wb")
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return gzip.open(path, "wt", encoding="utf-8")
+
+def export_records(records, path, fmt="json", compress=False):
+    """ Write records to ``path`` one at a time, so nothing but the current
+        record is held in memory. Returns the number of records written.
+        The file is removed when ``records`` fails part way.
+    """
+    total = 0
+    with metrics.phase("export"):
+        out = open_export(path, compress=compress)
+        try:
+            with out:
+                if fmt == "ndjson":
+                    for record in records:
+                        out.write(json.dumps(record.to_dict()))
+                        out.write("\n")
+                        total += 1
+                else:
+                    # same layout as json.dumps(records, indent=4), one element at a time
+                    out.write("[")
+                    for record in records:
+                        element = json.dumps(record.to_dict(), indent=4).replace("\n", "\n    ")
+                        out.write(f"{',' if total else ''}\n    {element}")
+                        total += 1
+                    out.write("\n]" if total else "]")
+        except BaseException:
+            if path != "-":
+                os.remove(path)
+            raise
+    metrics.add("export", records=total)
+    return total
+
+def load_manifest(stream):
+    try:
+        return Manifest.load(stream)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+def planning_dns(config, manifest, zone, records, replace=True, prune=False, cache=None, refresh=False):
+    """ Compare the desired records of a zone with its live content.
+        Returns the zone's DNSService and the changes needed to converge.
+    """
+    service = init_manifest_service(config, manifest, zone)
+    dns_zone = service.fetch_zone(cache=cache, refresh=refresh)
+    changes = plan_zone(dns_zone, records, replace=replace, prune=prune)
+    for change in changes:
+        change["zone"] = zone
+    return service, changes
+
+def show_changes(changes):
+    rows = [
+        dict(change, content=", ".join(change["content"] or change["current"]))
+        for change in changes
+    ]
+    output = utils.Formatter.from_dict(
+        rows,
+        headers=["ACTION", "NAME", "RTYPE", "TTL", "CONTENT", "ZONE"],
+        attr=["action", "name", "rtype", "ttl", "content", "zone"]
+    )
+    click.echo("\n".join(output))
+
+    summary = {action: 0 for action in ("add", "replace", "delete")}
+    for change in changes:
+        summary[change["action"]] += 1
+    click.echo(f"\nPlan: {summary['add']} to add, {summary['replace']} to replace, "
+               f"{summary['delete']} to delete")
@@ -1,5 +1,10 @@
 
+import os
 import click
+import glob
+import pickle
+import hashlib
+import tempfile
 import configparser
 from click_configfile import (
     ConfigFileReader, 
@@ -11,6 +16,8 @@ from click_configfile import (
     select_config_sections
 )
 
+from dnsmanager.metrics import metrics
+
 
 class ConfigSectionSchema(object):
     """Describes all config sections of this configuration file."""
@@ -23,6 +30,8 @@ class ConfigSectionSchema(object):
     class DNS(SectionSchema):
         rtype = Param(type=str)
         ttl = Param(type=str)
+        cache_dir = Param(type=str)
+        socket = Param(type=str)
 
     @matches_section("dns.zones")
     class DNSZoneAvailable(SectionSchema):
@@ -32,6 +41,9 @@ class ConfigSectionSchema(object):
     class DNSZoneItems(SectionSchema):
         name = Param(type=str)
         server = Param(type=str)
+        port = Param(type=int)
+        transport = Param(type=str)
+        payload = Param(type=int)
         keyring_name = Param(type=str)
         keyring_value = Param(type=str)
 
@@ -39,6 +51,7 @@ class ConfigSectionSchema(object):
 class ConfigFileProcessor(ConfigFileReader):
     config_files = ["config.cfg", "config.ini"]
     config_searchpath = ["."]
+    config_file_names = None
     config_section_schemas = [
         ConfigSectionSchema.Defaults,
         ConfigSectionSchema.DNS,
@@ -48,17 +61,41 @@ class ConfigFileProcessor(ConfigFileReader):
 
     @property
     def config_path(self):
-        import os
         cls = self.__class__
-        configfile_names = list(generate_configfile_names(cls.config_files, cls.config_searchpath))
+        configfile_names = cls.config_file_names or list(
+            generate_configfile_names(cls.config_files, cls.config_searchpath))
         config_param = Param(type=click.File("r")) 
         config_file = config_param.parse(configfile_names[0])
         return os.path.realpath(config_file.name)
 
     @classmethod
-    def read_config(cls):
+    @metrics.timed("config_load")
+    def read_config(cls, use_cache=True):
+        """ Parse the configuration files, or load the storage compiled from them
+            last time when none of them changed since
+        """
         configfile_names = list(
             generate_configfile_names(cls.config_files, cls.config_searchpath))
+        cls.config_file_names = configfile_names
+        if not use_cache:
+            return cls.parse_config(configfile_names)
+
+        cache_file = config_cache_file(configfile_names)
+        try:
+            with open(cache_file, "rb") as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+        storage = cls.parse_config(configfile_names)
+        try:
+            save_config_cache(cache_file, storage)
+        except OSError:
+            pass
+        return storage
+
+    @classmethod
+    def parse_config(cls, configfile_names):
         parser = configparser.ConfigParser()
         parser.optionxform = str
         parser.read(configfile_names)
@@ -68,15 +105,17 @@ class ConfigFileProcessor(ConfigFileReader):
             cls.config_sections = cls.collect_config_sections_from_schemas()
 
         storage = {}
+        # sections already parsed, so an inherited section is resolved only once
+        parsed = {}
         for section_name in select_config_sections(parser.sections(),
                                                    cls.config_sections):
             # print("PROCESS-SECTION: %s" % section_name)
             config_section = parser[section_name]
-            cls.process_config_section(parser, config_section, storage)
+            cls.process_config_section(parser, config_section, storage, parsed=parsed)
         return storage
         
     @classmethod
-    def process_config_section(cls, parser_sections, config_section, storage):
+    def process_config_section(cls, parser_sections, config_section, storage, parsed=None):
         schema = cls.select_config_schema_for(config_section.name)
         if not schema:
             message = "No schema found for: section=%s"
@@ -84,17 +123,61 @@ class ConfigFileProcessor(ConfigFileReader):
 
         # -- PARSE AND STORE CONFIG SECTION:
         section_storage = cls.select_storage_for(config_section.name, storage)
-        section_data = parse_config_section(parser_sections, config_section, schema)
+        section_data = parse_config_section(parser_sections, config_section, schema, parsed=parsed)
         section_storage.update(section_data)
 
-def parse_config_section(parser, config_section, section_schema):
+def config_cache_file(configfile_names):
+    """ Compiled config location: <paths>.<stamps>.pickle, keyed by the paths of
+        the source files, then by their size and mtime and the version
+    """
+    from dnsmanager import __version__
+    from dnsmanager.cache import default_cache_dir
+
+    paths = hashlib.sha1()
+    stamps = hashlib.sha1(__version__.encode())
+    for name in configfile_names:
+        stat = os.stat(name)
+        paths.update(f"{os.path.realpath(name)};".encode())
+        stamps.update(f"{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return os.path.join(default_cache_dir(), "config", f"{paths.hexdigest()}.{stamps.hexdigest()}.pickle")
+
+def save_config_cache(cache_file, storage):
+    """ Write the compiled config, which holds the TSIG secrets, readable by
+        this user only, and remove the ones compiled from earlier versions
+        of the same files
+    """
+    directory = os.path.dirname(cache_file)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.chmod(directory, 0o700)
+    # mkstemp creates the file 0600
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(storage, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache_file)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+    paths, _, _ = os.path.basename(cache_file).partition(".")
+    for name in glob.glob(os.path.join(directory, "*.pickle")):
+        if os.path.basename(name).startswith(f"{paths}.") and name != cache_file:
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+def parse_config_section(parser, config_section, section_schema, parsed=None):
+
+    if parsed is not None and config_section.name in parsed:
+        return dict(parsed[config_section.name])
 
     storage = {}
     if config_section.get("inherit"):
         inherit_section = config_section.pop("inherit")
         inherit_schema = ConfigFileProcessor.select_config_schema_for(inherit_section)
         inherit_section_data = parse_config_section(
-            parser, parser[inherit_section], inherit_schema)
+            parser, parser[inherit_section], inherit_schema, parsed=parsed)
         storage.update(inherit_section_data)
 
     for name, param in select_params_from_section_schema(section_schema):
@@ -106,4 +189,7 @@ def parse_config_section(parser, config_section, section_schema):
         else:
             value = param.parse(value)
         storage[name] = value
+
+    if parsed is not None:
+        parsed[config_section.name] = dict(storage)
     return storage
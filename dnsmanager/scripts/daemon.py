@@ -0,0 +1,325 @@
+
+import os
+import json
+import signal
+import socket
+import threading
+import socketserver
+
+# seconds a client waits for the daemon to accept its connection
+CONNECT_TIMEOUT = 0.5
+
+# requests answered with one line per item and an end marker, so a whole zone is never one line
+STREAMED_OPS = ("import",)
+
+
+def socket_path(config):
+    """ Unix socket of `dnsmanager serve`: $DNSMANAGER_SOCKET, the [dns] socket
+        option, or dnsmanager.sock in the runtime or cache directory
+    """
+    path = os.environ.get("DNSMANAGER_SOCKET") or config.get("dns", {}).get("socket")
+    if path:
+        return os.path.expanduser(path)
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "dnsmanager.sock")
+
+    from dnsmanager.cache import default_cache_dir
+    return os.path.join(default_cache_dir(), "dnsmanager.sock")
+
+
+class DaemonError(Exception):
+    """ A request the daemon answered with an error """
+
+
+class DaemonClient(object):
+    """ Connection to a running `dnsmanager serve`.
+
+        Requests and responses are JSON documents, one per line, over the
+        daemon's Unix socket. The connection is kept for every request of
+        the command. A STREAMED_OPS request is answered with an
+        ``{"ok": true, "item": ...}`` line per item, then ``{"ok": true, "end": true}``.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.stream = sock.makefile("rb")
+
+    @classmethod
+    def connect(cls, path, config_path):
+        """ Client of the daemon listening on ``path``, or None when there is
+            none or it serves another configuration file
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(path)
+            sock.settimeout(None)
+            client = cls(sock)
+            if client.request("hello").get("config") == config_path:
+                return client
+        except (OSError, ValueError, DaemonError):
+            pass
+        sock.close()
+        return None
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def send(self, op, params):
+        self.sock.sendall(json.dumps({"op": op, "params": params}).encode() + b"\n")
+
+    def receive(self):
+        line = self.stream.readline()
+        if not line:
+            raise DaemonError("Connection closed by the daemon")
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise DaemonError(response.get("error"))
+        return response
+
+    def request(self, op, **params):
+        self.send(op, params)
+        return self.receive().get("data")
+
+    def request_stream(self, op, **params):
+        """ Items of a STREAMED_OPS response as they arrive. It has to be read
+            to the end before the next request of the connection
+        """
+        self.send(op, params)
+        while True:
+            response = self.receive()
+            if response.get("end"):
+                return
+            yield response["item"]
+
+    def service(self, zone):
+        return RemoteService(self, zone)
+
+    def find(self, **params):
+        """ searching_dns run by the daemon: the matching records and the zones that failed """
+        from dnsmanager.records import Record
+
+        data = self.request("find", **params)
+        return [Record.from_dict(record) for record in data["records"]], data["errors"]
+
+    def find_many(self, **params):
+        """ bulk_searching_dns run by the daemon: (zone, [(query, record)], error) for every zone """
+        from dnsmanager.records import Record
+
+        return [
+            (zone, [(query, Record.from_dict(record)) for query, record in matches], error)
+            for zone, matches, error in self.request("find_many", **params)
+        ]
+
+
+class RemoteService(object):
+    """ The record operations of a DNSService, carried out by the daemon's warm one """
+
+    def __init__(self, client, zone):
+        self.client = client
+        self.zone = zone
+
+    def result(self, op, **params):
+        from dnsmanager.core import Result
+
+        try:
+            return Result.from_dict(self.client.request(op, zone=self.zone, **params))
+        except DaemonError as e:
+            return Result(error=str(e))
+
+    def add_record(self, name, content, rtype, ttl=300, prerequisite=None):
+        return self.result("add", name=name, content=content, rtype=rtype, ttl=ttl, prerequisite=prerequisite)
+
+    def update_record(self, name, content, rtype, ttl=300):
+        return self.result("update", name=name, content=content, rtype=rtype, ttl=ttl)
+
+    def remove_record(self, name, rtype=None):
+        return self.result("remove", name=name, rtype=rtype)
+
+    def iter_records(self, cache=None, refresh=False):
+        from dnsmanager.records import Record
+
+        records = self.client.request_stream("import", zone=self.zone, no_cache=cache is None, refresh=refresh)
+        return (Record.from_dict(record) for record in records)
+
+    def import_records(self, cache=None, refresh=False):
+        return list(self.iter_records(cache=cache, refresh=refresh))
+
+    def close(self):
+        pass
+
+
+class Daemon(object):
+    """ Serve find (single or --from-file), new, put, rm and import for the
+        other commands of this configuration, keeping the DNSService
+        instances of the registry, their connections and the zone snapshots
+        and indexes warm between requests.
+
+        The configuration is read again, and the services replaced, when
+        one of its files changes.
+    """
+
+    def __init__(self, config, config_path, reader):
+        from dnsmanager.cache import MemoryZoneCache
+
+        self.config_path = config_path
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.config = config
+        self.stamp = self.config_stamp()
+        self.cache = MemoryZoneCache(self.config.get("dns", {}).get("cache_dir"))
+
+    def config_stamp(self):
+        stamp = []
+        for name in self.reader.config_file_names or []:
+            try:
+                stat = os.stat(name)
+            except OSError:
+                stamp.append((name, None))
+            else:
+                stamp.append((name, stat.st_size, stat.st_mtime_ns))
+        return stamp
+
+    def current_config(self):
+        from dnsmanager.registry import registry
+
+        with self.lock:
+            stamp = self.config_stamp()
+            if stamp != self.stamp:
+                self.config = self.reader.read_config()
+                self.stamp = stamp
+                registry.invalidate()
+            return self.config
+
+    def zone_obj(self, config, zone):
+        if zone not in config["dns.zones"]["available"]:
+            raise ValueError(f"Zone ({zone}) not found in configuration file ({self.config_path})")
+        return self.reader.select_storage_for(f"dns.zones.{zone}", config)
+
+    def handle(self, op, params):
+        from dnsmanager.metrics import metrics
+        from dnsmanager.utils import ZoneTrie
+        from dnsmanager.scripts.commands.services import init_dns_service
+        from dnsmanager.scripts.commands.utils import searching_dns, bulk_searching_dns, parse_queries
+
+        if op == "hello":
+            return {"config": self.config_path, "pid": os.getpid()}
+        if op == "metrics":
+            return metrics.to_dict()
+
+        config = self.current_config()
+        if op == "find":
+            records, errors = searching_dns(
+                config, config["dns.zones"]["available"],
+                params["domain"], params.get("content"), params.get("rtype"), params.get("ttl"),
+                params.get("zone"),
+                cache=None if params.get("no_cache") else self.cache,
+                refresh=params.get("refresh", False),
+                workers=params.get("workers", 8),
+                timeout=params.get("timeout"),
+                match=params.get("match", "substring"),
+            )
+            return {"records": [record.to_dict() for record in records], "errors": errors}
+        if op == "find_many":
+            available_zones = config["dns.zones"]["available"]
+            searched = bulk_searching_dns(
+                config, available_zones,
+                parse_queries(params["lines"], ZoneTrie(available_zones), zone=params.get("zone")),
+                rtype=params.get("rtype"),
+                zone=params.get("zone"),
+                match=params.get("match"),
+                cache=None if params.get("no_cache") else self.cache,
+                refresh=params.get("refresh", False),
+                workers=params.get("workers", 8),
+                timeout=params.get("timeout"),
+            )
+            return [
+                (zone, [(query, record.to_dict()) for query, record in matches], error)
+                for zone, matches, error in searched
+            ]
+
+        service = init_dns_service(self.zone_obj(config, params.pop("zone")))
+        if op == "add":
+            result = service.add_record(**params)
+        elif op == "update":
+            result = service.update_record(**params)
+        elif op == "remove":
+            result = service.remove_record(**params)
+        else:
+            raise ValueError(f"Unknown request ({op})")
+        return dict(result.to_dict(), text=result.text)
+
+    def stream(self, op, params):
+        """ Items of a STREAMED_OPS request, generated as they are read """
+        from dnsmanager.scripts.commands.services import init_dns_service
+
+        if op != "import":
+            raise ValueError(f"Unknown request ({op})")
+        service = init_dns_service(self.zone_obj(self.current_config(), params["zone"]))
+        cache = None if params.get("no_cache") else self.cache
+        for record in service.iter_records(cache=cache, refresh=params.get("refresh")):
+            yield record.to_dict()
+
+    def serve_forever(self, path):
+        """ Listen on the Unix socket ``path`` until interrupted """
+        from dnsmanager.registry import registry
+
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.remove(path)
+            else:
+                raise OSError(f"Another daemon is listening on {path}")
+            finally:
+                probe.close()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # the socket sends TSIG signed updates for whoever connects, so it stays private to this user
+        umask = os.umask(0o177)
+        try:
+            server = DaemonServer(path, DaemonHandler, daemon=self)
+        finally:
+            os.umask(umask)
+        # stopped like an interrupt, so the socket is removed on the way out
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(path)
+            registry.invalidate()
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handler, daemon):
+        self.daemon = daemon
+        super().__init__(path, handler)
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    # streamed records are written a buffer at a time, each response is flushed
+    wbufsize = 1 << 16
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op, params = request.get("op"), dict(request.get("params") or {})
+                if op in STREAMED_OPS:
+                    for item in self.server.daemon.stream(op, params):
+                        self.write({"ok": True, "item": item})
+                    response = {"ok": True, "end": True}
+                else:
+                    response = {"ok": True, "data": self.server.daemon.handle(op, params)}
+            except Exception as e:
+                response = {"ok": False, "error": str(e) or e.__class__.__name__}
+            self.write(response)
+            self.wfile.flush()
+
+    def write(self, response):
+        self.wfile.write(json.dumps(response).encode() + b"\n")
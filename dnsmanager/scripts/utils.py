@@ -1,7 +1,8 @@
 
-import threading
-import time
+import queue
 import inspect
+import threading
+from concurrent.futures import Future, CancelledError
 from dnsmanager import utils
 
 def prompt_for_password(prompt):
@@ -35,37 +36,52 @@ def prompt_y_n_question(question, default="no"):
             print("Please, respond with 'yes' or 'no' or 'y' or 'n'.")
 
 
-class Threading(object):
-    """ Threading example class
-    The run() method will be started and it will run in the background
-    until the application exits.
+class Worker(object):
+    """ Run a function in a background thread and follow it through its progress events.
+
+        The function is called with a ``report`` keyword argument to post
+        events with; ``events()`` blocks on them until the function returns,
+        and its return value or exception is then available from ``future``.
+        The thread is a daemon, so an interrupted command exits at once;
+        after ``cancel()`` the next report raises CancelledError in it.
     """
 
+    DONE = object()
+
     def __init__(self, func, *args, **kwargs):
-        """ Constructor
-        :type interval: int
-        :param interval: Check interval, in seconds
-        """
-        self.result = None
-        self.exception = None
-        thread = threading.Thread(target=self.run(func, *args, **kwargs), args=())
-        thread.daemon = True                  # Daemonize thread
-        thread.start()                        # Start the execution
-
-    @property
-    def progress(self):
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.future = Future()
+        self.future.add_done_callback(lambda future: self.queue.put(self.DONE))
+        threading.Thread(target=self.run, args=(func, args, kwargs), daemon=True).start()
+
+    def run(self, func, args, kwargs):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = func(*args, report=self.report, **kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+    def report(self, event):
+        if self.cancelled.is_set():
+            raise CancelledError()
+        self.queue.put(event)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def events(self):
         while True:
-            yield self.result
-        
+            event = self.queue.get()
+            if event is self.DONE:
+                return
+            yield event
 
-    def run(self, func, *args, **kwargs):
-        """ Method that runs forever """
-        def function():
-            try:
-                self.result = func(*args, **kwargs)
-            except Exception as e:
-                self.exception = str(e)
-        return function
+    def result(self, timeout=None):
+        return self.future.result(timeout=timeout)
 
 import json
 from click.types import convert_type
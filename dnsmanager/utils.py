@@ -187,4 +187,171 @@ class dotdict(dict):
             if not isinstance(obj, dict):
                 break
             obj=obj[k]
-        return obj
\ No newline at end of file
+        return obj
+
+class ZoneTrie(object):
+    """ Configured zones by their labels from the root, so the most specific
+        zone holding a name is found in one walk over the name's labels.
+
+        >>>
+        zones = ZoneTrie(["local", "dev1.local"])
+        zones.split("a.b.dev1.local")
+        return:
+            ("dev1.local", "a.b")
+    """
+
+    def __init__(self, zones=()):
+        self.root = {}
+        self.zones = set()
+        for zone in zones:
+            self.add(zone)
+
+    def __contains__(self, zone):
+        return zone in self.zones
+
+    def __len__(self):
+        return len(self.zones)
+
+    def add(self, zone):
+        node = self.root
+        for label in reversed(zone.rstrip(".").lower().split(".")):
+            node = node.setdefault(label, {})
+        # the None key marks a node that is a zone apex
+        node[None] = zone
+        self.zones.add(zone)
+
+    def split(self, name):
+        """ The most specific zone holding ``name`` and the name relative to it,
+            "@" for the apex; (None, name) when no zone holds it
+        """
+        labels = name.rstrip(".").split(".")
+        node, zone, depth = self.root, None, 0
+        for index, label in enumerate(reversed(labels), 1):
+            node = node.get(label.lower())
+            if node is None:
+                break
+            if None in node:
+                zone, depth = node[None], index
+        if zone is None:
+            return None, name
+        return zone, ".".join(labels[:len(labels) - depth]) or "@"
+
+
+import time
+import queue
+import threading
+from concurrent.futures import Future, InvalidStateError, wait, FIRST_COMPLETED
+
+class DaemonPool(object):
+    """ The submit and shutdown of a ThreadPoolExecutor on daemon threads.
+
+        The interpreter joins the threads of a ThreadPoolExecutor at exit,
+        so an interrupted find waited for every zone still blocked on the
+        network. These threads are left behind instead, and leaving the
+        ``with`` block on an exception cancels the work not started yet.
+
+        >>>
+        with DaemonPool(8) as pool:
+            futures = [pool.submit(fetch, zone) for zone in zones]
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.queue = queue.Queue()
+        self.threads = []
+        # future -> (thread, start time) of the work running
+        self.running = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.shutdown(wait=exc_type is None, cancel_futures=exc_type is not None)
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.queue.put((future, func, args, kwargs))
+        if len(self.threads) < self.max_workers:
+            thread = threading.Thread(target=self.work, daemon=True)
+            self.threads.append(thread)
+            thread.start()
+        return future
+
+    def work(self):
+        thread = threading.current_thread()
+        while thread in self.threads:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.running[future] = (thread, time.monotonic())
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                self.settle(future, future.set_exception, e)
+            else:
+                self.settle(future, future.set_result, result)
+
+    def settle(self, future, method, value):
+        self.running.pop(future, None)
+        try:
+            method(value)
+        except InvalidStateError:
+            # given up on by as_completed
+            pass
+
+    def abandon(self, future, timeout):
+        """ Fail ``future`` with a TimeoutError and leave its thread to
+            finish on its own, in place of a new one for the queued work
+        """
+        thread, _ = self.running.pop(future, (None, None))
+        try:
+            future.set_exception(TimeoutError(f"timed out after {timeout:g}s"))
+        except InvalidStateError:
+            return
+        if thread in self.threads:
+            self.threads.remove(thread)
+            thread = threading.Thread(target=self.work, daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def as_completed(self, futures, timeout=None):
+        """ Yield ``futures`` as they complete, failing with a TimeoutError
+            those still running ``timeout`` seconds after they started
+        """
+        pending = set(futures)
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.monotonic()
+                # work still queued is looked at again shortly, once it may have started
+                deadlines = [timeout]
+                for future in pending:
+                    _, started = self.running.get(future, (None, None))
+                    if started is None:
+                        deadlines.append(min(timeout, 0.1))
+                        continue
+                    if now - started >= timeout:
+                        self.abandon(future, timeout)
+                    else:
+                        deadlines.append(started + timeout - now)
+                wait_for = min(deadlines)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            yield from done
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        if cancel_futures:
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+        for _ in self.threads:
+            self.queue.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join()
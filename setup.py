@@ -14,7 +14,7 @@ setup(
     url=__url__,
     description=__description__,
     py_modules=['dnsmanager'],
-    install_requires=["click", "click_configfile", "dnspython"],
+    install_requires=["click", "click_configfile", "dnspython", "PyYAML"],
     packages=find_packages(),
     entry_points = '''
         [console_scripts]
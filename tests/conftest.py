@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# FakeServer lives with the benchmarks, which are not a package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from server import FakeServer  # noqa: E402
+from dnsmanager.core import DNSService  # noqa: E402
+
+ZONE = "bench.local"
+
+
+@pytest.fixture
+def server():
+    with FakeServer(ZONE, size=100) as server:
+        yield server
+
+@pytest.fixture
+def service(server):
+    return DNSService(ZONE, server.address, *server.key, port=server.port, timeout=2)
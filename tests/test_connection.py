@@ -0,0 +1,40 @@
+import dns.message
+import dns.rdatatype
+
+from dnsmanager.connection import Connection
+
+
+def queries(count):
+    return [dns.message.make_query(f"host-{n}.bench.local", dns.rdatatype.A) for n in range(count)]
+
+def test_pipeline_answers_in_order(server):
+    with Connection(server.address, port=server.port, timeout=2, depth=4) as connection:
+        responses = connection.pipeline(queries(10))
+    assert [str(response.question[0].name) for response in responses] == [
+        f"host-{n}.bench.local." for n in range(10)
+    ]
+    assert str(responses[1].answer[0][0]) == "10.0.0.1"
+
+def test_pipeline_reuses_the_connection(server):
+    with Connection(server.address, port=server.port, timeout=2) as connection:
+        connection.pipeline(queries(3))
+        sock = connection.sock
+        connection.pipeline(queries(3))
+        assert connection.sock is sock
+
+def test_duplicate_ids_are_reassigned(server):
+    messages = queries(3)
+    for message in messages:
+        message.id = 7
+    with Connection(server.address, port=server.port, timeout=2) as connection:
+        responses = connection.pipeline(messages)
+    assert len({message.id for message in messages}) == 3
+    assert [response.id for response in responses] == [message.id for message in messages]
+
+def test_reconnects_after_server_close(server):
+    connection = Connection(server.address, port=server.port, timeout=2)
+    connection.pipeline(queries(1))
+    connection.sock.close()
+    connection.sock = None
+    assert len(connection.pipeline(queries(2))) == 2
+    connection.close()
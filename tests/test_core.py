@@ -0,0 +1,36 @@
+import dns.rcode
+import pytest
+from dns.exception import DNSException
+
+from dnsmanager.core import DNSService, NAME_NOT_IN_USE, RRSET_NOT_EXISTS
+
+
+def test_add_with_name_not_in_use(service, server):
+    assert service.add_record("fresh", "10.1.0.1", "A", prerequisite=NAME_NOT_IN_USE).rcode == dns.rcode.NOERROR
+    result = service.add_record("host-1", "10.1.0.1", "A", prerequisite=NAME_NOT_IN_USE)
+    assert result.rcode == dns.rcode.YXDOMAIN
+    assert not result.ok
+    assert len(server.journal) == 1
+
+def test_add_with_rrset_not_exists(service):
+    assert service.add_record("host-1", "10.1.0.1", "A", prerequisite=RRSET_NOT_EXISTS).rcode == dns.rcode.YXRRSET
+    assert service.add_record("host-1", "10 mail", "MX", prerequisite=RRSET_NOT_EXISTS).rcode == dns.rcode.NOERROR
+
+def test_unknown_prerequisite(service):
+    with pytest.raises(ValueError):
+        service.add_record("fresh", "10.1.0.1", "A", prerequisite="maybe")
+
+def test_bad_key_is_reported(server):
+    service = DNSService("bench.local", server.address, server.key[0], "c2VjcmV0", port=server.port, timeout=2)
+    result = service.add_record("fresh", "10.1.0.1", "A")
+    assert not result.ok
+    assert "BADSIG" in result.text or "BADKEY" in result.text
+
+def test_lookup_nxdomain_is_empty(service):
+    assert service.lookup_records("nothere") == []
+    assert [record.content for record in service.lookup_records("host-1")] == ["10.0.0.1"]
+
+def test_lookup_error_rcode_raises(server):
+    service = DNSService("other.local", server.address, *server.key, port=server.port, timeout=2)
+    with pytest.raises(DNSException, match="REFUSED"):
+        service.lookup_records("host-1")
@@ -0,0 +1,37 @@
+import ipaddress
+
+import pytest
+
+
+def names(records):
+    return [record.name for record in records]
+
+def test_name_index_exact(service):
+    index = service.name_index()
+    assert names(index.search("host-1")) == ["host-1"]
+    assert names(index.search("HOST-1")) == ["host-1"]
+    assert index.search("host-1000") == []
+
+def test_name_index_prefix_suffix_glob(service):
+    index = service.name_index()
+    assert names(index.search("host-9", match="prefix")) == ["host-9"] + [f"host-{n}" for n in range(90, 100)]
+    assert names(index.search("*-99", match="suffix")) == ["host-99"]
+    assert names(index.search("host-?5", match="glob")) == [f"host-{n}5" for n in range(1, 10)]
+    assert len(index.search("ost-1", match="substring")) == 11
+
+def test_name_index_rtype(service):
+    index = service.name_index()
+    # every 20th generated name is an MX, every other 10th a CNAME
+    assert names(index.search("host-", match="prefix", rtype="MX")) == [f"host-{n}" for n in (19, 39, 59, 79, 99)]
+
+def test_name_index_unknown_match(service):
+    with pytest.raises(ValueError):
+        service.name_index().search("host-1", match="regex")
+
+def test_ip_index_address_and_range(service):
+    index = service.ip_index()
+    assert names(index.search("10.0.0.1")) == ["host-1"]
+    assert [record.content for record in index.search("10.0.0.0/29")] == [f"10.0.0.{n}" for n in range(8)]
+    # the .9 and .19 names are not A records
+    assert "host-9" not in names(index.search(ipaddress.ip_network("10.0.0.0/24")))
+    assert index.search("192.168.0.0/16") == []
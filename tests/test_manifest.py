@@ -0,0 +1,20 @@
+import pytest
+
+from dnsmanager.manifest import Manifest
+
+ZONES = [{"name": "dev1.local"}]
+
+
+def test_defaults_and_single_zone():
+    manifest = Manifest(ZONES, [{"name": "web", "content": "10.0.0.1"}], defaults={"rtype": "a", "ttl": "300"})
+    assert manifest.records == [
+        {"name": "web", "content": "10.0.0.1", "rtype": "A", "ttl": 300, "zone": "dev1.local"}
+    ]
+
+def test_ttl_zero_is_kept():
+    manifest = Manifest(ZONES, [{"name": "web", "content": "10.0.0.1", "rtype": "A", "ttl": 0}])
+    assert manifest.records[0]["ttl"] == 0
+
+def test_missing_fields():
+    with pytest.raises(ValueError, match="missing content, ttl"):
+        Manifest(ZONES, [{"name": "web", "content": "", "rtype": "A"}])
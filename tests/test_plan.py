@@ -0,0 +1,43 @@
+import dns.name
+import dns.rdatatype
+
+from dnsmanager.plan import diff
+
+A = dns.rdatatype.A
+
+
+def key(name, rdtype=A):
+    return dns.name.from_text(name, origin=None), rdtype
+
+def test_diff_add_and_replace():
+    live = {key("web"): (300, frozenset({"10.0.0.1"}))}
+    desired = {key("web"): (300, {"10.0.0.2"}), key("api"): (60, {"10.0.0.3"})}
+    changes = diff(live, desired)
+    assert [(change["action"], change["name"], change["content"]) for change in changes] == [
+        ("replace", "web", ["10.0.0.2"]),
+        ("add", "api", ["10.0.0.3"]),
+    ]
+    assert changes[0]["current"] == ["10.0.0.1"]
+
+def test_diff_ttl_change_is_a_replace():
+    live = {key("web"): (300, frozenset({"10.0.0.1"}))}
+    assert [change["ttl"] for change in diff(live, {key("web"): (60, {"10.0.0.1"})})] == [60]
+
+def test_diff_add_only():
+    live = {key("web"): (300, frozenset({"10.0.0.1"}))}
+    desired = {key("web"): (300, {"10.0.0.1", "10.0.0.2"})}
+    changes = diff(live, desired, replace=False)
+    assert [(change["action"], change["content"]) for change in changes] == [("add", ["10.0.0.2"])]
+    assert diff(live, {key("web"): (300, {"10.0.0.1"})}, replace=False) == []
+
+def test_diff_prune_deletes_first_and_spares_protected():
+    live = {
+        key("@", dns.rdatatype.NS): (3600, frozenset({"ns1"})),
+        key("ns1"): (3600, frozenset({"127.0.0.1"})),
+        key("old"): (300, frozenset({"10.0.0.9"})),
+    }
+    desired = {key("new"): (300, {"10.0.0.1"})}
+    protected = {dns.name.empty, dns.name.from_text("ns1", origin=None)}
+    changes = diff(live, desired, prune=True, protected=protected)
+    assert [(change["action"], change["name"]) for change in changes] == [("delete", "old"), ("add", "new")]
+    assert [change["action"] for change in diff(live, desired, protected=protected)] == ["add"]
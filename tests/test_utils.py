@@ -0,0 +1,17 @@
+from dnsmanager.utils import ZoneTrie
+
+
+def test_split_most_specific_zone():
+    zones = ZoneTrie(["local", "dev1.local"])
+    assert zones.split("a.b.dev1.local") == ("dev1.local", "a.b")
+    assert zones.split("a.dev2.local") == ("local", "a.dev2")
+
+def test_split_apex_and_case():
+    zones = ZoneTrie(["dev1.local"])
+    assert zones.split("dev1.local.") == ("dev1.local", "@")
+    assert zones.split("Web.DEV1.Local") == ("dev1.local", "Web")
+
+def test_split_outside_every_zone():
+    zones = ZoneTrie(["dev1.local"])
+    assert zones.split("a.dev2.local") == (None, "a.dev2.local")
+    assert zones.split("local") == (None, "local")